@@ -1,39 +1,42 @@
 #!/usr/bin/env python3
-from pyaccsharedmemory import accSharedMemory  # type: ignore
 import time
+import threading
+import socket
 import sys
-import requests  # type: ignore
-from requests.adapters import HTTPAdapter  # type: ignore
 import json
 import configparser
 import signalfx  # type: ignore
 import urllib3  # type: ignore
-import background  # type: ignore
-import enum
 from rich.panel import Panel  # type: ignore
 from rich.layout import Layout  # type: ignore
-from rich.live import Live  # type: ignore
 from rich.prompt import Prompt  # type: ignore
 import argparse
+from telemetry.console import Console
+from telemetry.executor import Executor, describe_executors
+from telemetry.egress import HecSender, describe_wire
+from telemetry.instrument import Registry, SelfMetrics, serve_metrics, watch_sender, watch_executor
+from telemetry.shared_memory import SharedMemoryReader, PHYSICS_FIELDS
+from telemetry.flatten import MetricSelection, PageLayout, flattener_for
+from telemetry.spool import Spool
 
 layout = Layout()
 
 urllib3.disable_warnings()
-background.n = 100
 
 # mode should be 'spectator' to grab all cars, 'solo' to only grab data for the player car
 parser = argparse.ArgumentParser(description="ACC - Splunk Data Drivers")
 parser.add_argument("--hostname", help="Hostname", default="rig_1")
 parser.add_argument("-e", "--endpoint", help="Send data to Splunk Core, O11y Cloud or both", choices=["core", "o11y", "both"], default="both")
+parser.add_argument("--name", help="Player name, asked for when not given")
+parser.add_argument("--headless", help="Run without the console, for servers", action="store_true")
 args = vars(parser.parse_args())
 
+if args["headless"] and not args["name"]:
+    parser.error("--headless needs --name")
+
 hostname = args["hostname"]
 endpoint = args["endpoint"]
 
-physics_dict = {}
-graphics_dict = {}
-static_dict = {}
-
 config = configparser.ConfigParser()
 config.read("settings.ini")
 
@@ -52,20 +55,66 @@ sim_endpoint = config.get("ingest", "ingest_endpoint")
 physics = config.getboolean("telemetry", "physics")
 graphics = config.getboolean("telemetry", "graphics")
 static = config.getboolean("telemetry", "static")
+stats_interval = config.getfloat("telemetry", "stats_interval", fallback=0)
+metrics_port = config.getint("telemetry", "metrics_port", fallback=0)
+metrics_bind = config.get("telemetry", "metrics_bind", fallback="127.0.0.1")
+self_metrics_interval = config.getfloat("telemetry", "self_metrics_interval", fallback=0)
+# Shared memory reads per second and page; unchanged pages are skipped, so
+# the static page is only shipped when the session changes
+poll_rate = config.getfloat("telemetry", "poll_rate", fallback=10)
+page_rates = {
+    "physics": config.getfloat("telemetry", "physics_rate", fallback=poll_rate),
+    "graphics": config.getfloat("telemetry", "graphics_rate", fallback=poll_rate),
+    "static": config.getfloat("telemetry", "static_rate", fallback=1),
+}
+
+# The pages of one sourcetype are flattened in order on their own worker, they
+# keep their samples in order; samples are serialised for HEC on a small pool
+pages = Executor("pages", 3, config.getint("telemetry", "decode_queue_size", fallback=100), ordered=True)
+egress = Executor("egress", config.getint("ingest", "egress_threads", fallback=4), config.getint("ingest", "egress_queue_size", fallback=1000))
+
+# The same batching HEC pipeline as f1_2022_listener.py: many samples per
+# POST, gzip compressed with hec_gzip_level and spooled to hec_spool_dir
+# while HEC is unreachable
+hec_spool = None
+if config.get("ingest", "hec_spool_dir", fallback=""):
+    hec_spool = Spool(config.get("ingest", "hec_spool_dir"), config.getint("ingest", "hec_spool_max_mb", fallback=256) * 1024 * 1024)
+
+hec = HecSender(
+    splunk_hec_ip + ":" + splunk_hec_port + "/services/collector",
+    splunk_hec_token,
+    verify=False,
+    spool=hec_spool,
+    drain_rate=config.getfloat("ingest", "hec_spool_drain_rate", fallback=5.0),
+    max_queue=config.getint("ingest", "hec_queue_size", fallback=20000),
+    max_events=config.getint("ingest", "hec_batch_size", fallback=500),
+    max_linger=config.getfloat("ingest", "hec_linger", fallback=0.5),
+    max_bytes=config.getint("ingest", "hec_batch_bytes", fallback=0),
+    gzip_level=config.getint("ingest", "hec_gzip_level", fallback=0),
+)
+
+# Instrumentation: latency of reading shared memory, waiting for and
+# flattening a page and from queueing a sample for HEC to its batch being
+# acknowledged, pages read and HEC errors
+registry = Registry("acc_")
+stage_latency = {stage: registry.histogram("stage_seconds", stage=stage) for stage in ("read", "queue", "flatten")}
+stage_latency["http"] = registry.histogram("stage_seconds", hec.latency, stage="http")
+watch_sender(registry, hec)
+for executor in (pages, egress):
+    watch_executor(registry, executor)
 
 sim_metrics = []
 
 for key, metric in config.items("sim_metrics"):
     sim_metrics.append(metric)
 
+# Flattened fields sent to O11y, resolved against each page's keys once
+metric_selection = MetricSelection(sim_metrics, prefix="acc.")
+
 client = signalfx.SignalFx(ingest_endpoint=sim_endpoint)
 ingest = client.ingest(sim_token)
 
-# create session object for http keep alives
-sesh = requests.Session()
-sesh.mount("https://", HTTPAdapter(pool_connections=100, pool_maxsize=100, max_retries=0, pool_block=False))
-
-name = Prompt.ask("[b green]Please enter your name[/b green]")
+name = args["name"] or Prompt.ask("[b green]Please enter your name[/b green]")
 
 layout.split_column(Layout(name="upper", size=9), Layout(name="lower"))
 layout["upper"].split_row(
@@ -94,19 +143,17 @@ layout["top_right"].update(Layout(Panel("\n[i bright_red]Awaiting Player data ..
 
 
 def send_metrics(data, sourcetype):
-    telemetry_json = []
-
     dimensions = {"player_name": name, "sourcetype": sourcetype}
 
-    for k in data:
-        for key in sim_metrics:
-            if key in k:
-                telemetry_json.append({"metric": "acc." + k, "value": data[key], "dimensions": dimensions})
+    telemetry_json = [{"metric": metric, "value": value, "dimensions": dimensions} for metric, value in metric_selection.select(data)]
 
-    ingest.send(gauges=telemetry_json)
+    if telemetry_json:
+        ingest.send(gauges=telemetry_json)
 
 
-@background.task
+# Serialised here and queued on the HEC sender, which posts it with the next
+# batch; send failures and full queues are counted by the sender
+@egress.task
 def send_hec(data, sourcetype):
     #event = {}
     #event["host"] = hostname
@@ -119,81 +166,36 @@ def send_hec(data, sourcetype):
              'sourcetype': sourcetype,
              'source': 'acc',
              'time': int(time.time_ns() / 1000),
-             'event': data}
-
-    url = splunk_hec_ip + ":" + splunk_hec_port + "/services/collector"
-    header = {"Authorization": "Splunk " + splunk_hec_token}
+             'event': data.as_dict()}
 
-    try:
-        response = sesh.post(url=url, data=json.dumps(event), headers=header, verify=False)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        layout["top_right"].update(Layout(Panel("\n[i bright_red]Awaiting Player data ...[/i bright_red]", title="[b cyan]Telemetry", title_align="left")))
+    hec.send(json.dumps(event, separators=(",", ":")).encode())
 
 
-def get_physics_data(data):
-    for attr, val in data.__dict__.items():
-        if type(val).__name__ == "Wheels":
-            for w, v in val.__dict__.items():
-                physics_dict.update({attr + "_" + w: v})
-        elif type(val).__name__ == "CarDamage":
-            for w, v in val.__dict__.items():
-                physics_dict.update({attr + "_" + w: v})
-        elif type(val).__name__ == "Vector3f":
-            for w, v in val.__dict__.items():
-                physics_dict.update({attr + "_" + w: v})
-        elif type(val).__name__ == "ContactPoint":
-            for w, v in val.__dict__.items():
-                for x, y in v.__dict__.items():
-                    physics_dict.update({attr + "_" + w + "_" + x: y})
-        else:
-            physics_dict.update({attr: val})
-    
-    physics_dict.update({"driver_name": name})
-    
-    return physics_dict
+# Every sample becomes its own immutable Snapshot; the flatteners of the pages
+# are compiled on the first sample, see telemetry/flatten.py. Physics samples
+# are unpacked into their Snapshot by the reader, through physics_layout.
+physics_layout = PageLayout(PHYSICS_FIELDS, extra={"driver_name": name})
 
 
 def get_graphics_data(data):
-    counter = -1
-    for attr, val in data.__dict__.items():
-        if isinstance(val, str):
-            graphics_dict.update({attr: val.rstrip("\x00")})
-        elif attr == "car_coordinates":
-            for c in val:
-                coords = {}
-                for v, b in c.__dict__.items():
-                    coords.update({v: b})
-                counter += 1
-                graphics_dict.update({attr + "_" + str(counter): coords})
-        elif type(val).__name__ == "Wheels":
-            for w, v in val.__dict__.items():
-                graphics_dict.update({attr + "_" + w: v})
-        elif isinstance(val, enum.Enum):
-            pass
-        elif attr == "car_id":
-            pass
-        else:
-            graphics_dict.update({attr: val})
-
-    graphics_dict.update({"driver_name": name})
-
-    return graphics_dict
+    return flattener_for(data, skip=("car_id",), extra={"driver_name": name}).snapshot(data)
 
 
 def get_static_data(data):
-    for attr, val in data.__dict__.items():
-        if isinstance(val, str):
-            static_dict.update({attr: val.rstrip("\x00")})
-        else:
-            static_dict.update({attr: val})
+    return flattener_for(data, extra={"driver_name": name}).snapshot(data)
 
-    static_dict.update({"driver_name": name})
 
-    return static_dict
+def update_console(rpm, kmh, gear, brake, gas):
+    console.update("telemetry", (rpm, kmh, gear, brake, gas))
 
 
-def update_console(rpm, kmh, gear, brake, gas):
+# Rebuilds the telemetry panel from the latest values, on the console's refresh
+def render_telemetry(values):
+    if values is None:
+        layout["top_right"].update(Layout(Panel("\n[i bright_red]Awaiting Player data ...[/i bright_red]", title="[b cyan]Telemetry", title_align="left")))
+        return
+
+    rpm, kmh, gear, brake, gas = values
     kmh = round(kmh, 1)
     gear = gear - 1
     brake = brake * 100
@@ -215,12 +217,18 @@ def update_console(rpm, kmh, gear, brake, gas):
     )
 
 
-@background.task
-def process_data(data, sourcetype):
+console = Console(layout, refresh_per_second=0.5, headless=args["headless"])
+console.renderer("telemetry", render_telemetry)
+
+
+def process_data(data, sourcetype, read):
+    started = time.perf_counter()
+    stage_latency["queue"].observe(started - read)
+
     if sourcetype == "ACC_Physics":
-        json_payload = get_physics_data(data)
+        json_payload = data
 
-        update_console(data.rpm, data.speed_kmh, data.gear, data.brake, data.gas)
+        update_console(data["rpm"], data["speed_kmh"], data["gear"], data["brake"], data["gas"])
 
     if sourcetype == "ACC_Graphics":
         json_payload = get_graphics_data(data)
@@ -228,6 +236,8 @@ def process_data(data, sourcetype):
     if sourcetype == "ACC_Static":
         json_payload = get_static_data(data)
 
+    stage_latency["flatten"].observe(time.perf_counter() - started)
+
     if args["endpoint"] == "core" or args["endpoint"] == "both":
         send_hec(json_payload, sourcetype)
 
@@ -235,26 +245,67 @@ def process_data(data, sourcetype):
         send_metrics(json_payload, sourcetype)
 
 
+def report_stats(interval):
+    while True:
+        time.sleep(interval)
+        print(describe_executors([pages, egress]))
+
+
+# Next read time, interval, page and sourcetype of every enabled page
+def page_schedule():
+    enabled = {"static": static, "graphics": graphics, "physics": physics}
+    now = time.perf_counter()
+    return [[now, 1 / page_rates[page], page, sourcetype] for page, sourcetype in (("static", "ACC_Static"), ("graphics", "ACC_Graphics"), ("physics", "ACC_Physics")) if enabled[page]]
+
+
+# Read the pages that are due and changed, queue them for flattening and
+# return when the next page is due
+def poll(reader, schedule):
+    for entry in schedule:
+        due, interval, page, sourcetype = entry
+        started = time.perf_counter()
+        if due > started:
+            continue
+        # Keep to the page's rate, without bursting to catch up after a slow poll
+        entry[0] = max(due + interval, started)
+        data = reader.read(page)
+        if data is None:
+            continue
+        read = time.perf_counter()
+        stage_latency["read"].observe(read - started)
+        registry.inc("pages_total", page=page)
+        pages.submit(process_data, data, sourcetype, read, key=sourcetype)
+    return min((entry[0] for entry in schedule), default=time.perf_counter() + 1)
+
+
 if __name__ == "__main__":
-    with Live(layout, refresh_per_second = 0.5) as live:
+    started = time.monotonic()
+    pages.start()
+    egress.start()
+    if stats_interval:
+        threading.Thread(target=report_stats, name="report_stats", args=(stats_interval,), daemon=True).start()
+    if metrics_port:
+        serve_metrics(registry, metrics_port, metrics_bind)
+    self_metrics = SelfMetrics(registry, ingest, self_metrics_interval, {"host": socket.gethostname(), "player_name": name})
+    if self_metrics_interval:
+        self_metrics.start()
+    reader = SharedMemoryReader(layouts={"physics": physics_layout})
+    if reader.packet_id("physics") == 0:
+        reader.close()
+        sys.exit("No ACC metrics detected!")
+    registry.collect(lambda: [("pages_unchanged_total", {"page": page}, count, "counter") for page, count in reader.unchanged.items()])
+    with console:
         try:
+            schedule = page_schedule()
             while True:
-                asm = accSharedMemory()
-                sm = asm.read_shared_memory()
-                if not (isinstance(sm, type(None))):
-
-                    if static is True:
-                        process_data(sm.Static, "ACC_Static")
-
-                    if graphics is True:
-                        process_data(sm.Graphics, "ACC_Graphics")
-
-                    if physics is True:
-                        process_data(sm.Physics, "ACC_Physics")
-                    
-                    time.sleep(0.1)
-                else:
-                    asm.close()
-                    sys.exit("No ACC metrics detected!")
+                next_poll = poll(reader, schedule)
+                time.sleep(max(0, next_poll - time.perf_counter()))
         except KeyboardInterrupt:
-            asm.close()
+            reader.close()
+    pages.stop()
+    egress.stop()
+    hec.stop()
+    self_metrics.stop()
+    print(describe_executors([pages, egress]))
+    if args["endpoint"] == "core" or args["endpoint"] == "both":
+        print(f"HEC {describe_wire(hec.stats(), {}, time.monotonic() - started)}")
@@ -0,0 +1,120 @@
+# Samples per second the ACC flatteners turn into flat records, per page: the
+# original walk over data.__dict__ with type name checks into a shared dict
+# against the immutable snapshots of the layouts compiled once by
+# telemetry/flatten.py. Both hold the same fields. The physics page is also
+# unpacked straight from the mapping through its PageLayout, without parsing.
+# Pages are parsed from anonymous mappings, so it runs without the sim.
+# Run from the repository root: python -m benchmarks.acc_bench
+import enum
+import random
+import struct
+import timeit
+from pyaccsharedmemory import accSM, read_physic_map, read_graphics_map, read_static_map  # type: ignore
+from telemetry.flatten import PageLayout, flattener_for
+from telemetry.shared_memory import PHYSICS_FIELDS
+
+NAME = "bench"
+
+
+def old_physics(data, physics_dict):
+    for attr, val in data.__dict__.items():
+        if type(val).__name__ == "Wheels":
+            for w, v in val.__dict__.items():
+                physics_dict.update({attr + "_" + w: v})
+        elif type(val).__name__ == "CarDamage":
+            for w, v in val.__dict__.items():
+                physics_dict.update({attr + "_" + w: v})
+        elif type(val).__name__ == "Vector3f":
+            for w, v in val.__dict__.items():
+                physics_dict.update({attr + "_" + w: v})
+        elif type(val).__name__ == "ContactPoint":
+            for w, v in val.__dict__.items():
+                for x, y in v.__dict__.items():
+                    physics_dict.update({attr + "_" + w + "_" + x: y})
+        else:
+            physics_dict.update({attr: val})
+    physics_dict.update({"driver_name": NAME})
+    return physics_dict
+
+
+def old_graphics(data, graphics_dict):
+    counter = -1
+    for attr, val in data.__dict__.items():
+        if isinstance(val, str):
+            graphics_dict.update({attr: val.rstrip("\x00")})
+        elif attr == "car_coordinates":
+            for c in val:
+                coords = {}
+                for v, b in c.__dict__.items():
+                    coords.update({v: b})
+                counter += 1
+                graphics_dict.update({attr + "_" + str(counter): coords})
+        elif type(val).__name__ == "Wheels":
+            for w, v in val.__dict__.items():
+                graphics_dict.update({attr + "_" + w: v})
+        elif isinstance(val, enum.Enum):
+            pass
+        elif attr == "car_id":
+            pass
+        else:
+            graphics_dict.update({attr: val})
+    graphics_dict.update({"driver_name": NAME})
+    return graphics_dict
+
+
+def old_static(data, static_dict):
+    for attr, val in data.__dict__.items():
+        if isinstance(val, str):
+            static_dict.update({attr: val.rstrip("\x00")})
+        else:
+            static_dict.update({attr: val})
+    static_dict.update({"driver_name": NAME})
+    return static_dict
+
+
+def new_page(data, skip=()):
+    return flattener_for(data, skip, {"driver_name": NAME}).snapshot(data)
+
+
+# Parsed pages: physics full of random floats, graphics and static mostly
+# zero (their enums only accept known values) with NUL padded strings
+def sample_pages(rng):
+    physics = accSM(-1, 800)
+    struct.pack_into("=200f", physics, 0, *(rng.uniform(-500, 500) for _ in range(200)))
+    graphics = accSM(-1, 1588)
+    graphics.seek(12)
+    graphics.write("1:42.345".encode("utf-16-le"))
+    static = accSM(-1, 784)
+    static.seek(68)
+    static.write("ferrari_296_gt3".encode("utf-16-le"))
+    return physics, {
+        "physics": (read_physic_map(physics), old_physics, ()),
+        "graphics": (read_graphics_map(graphics), old_graphics, ("car_id",)),
+        "static": (read_static_map(static), old_static, ()),
+    }
+
+
+def per_sample(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(number=2000):
+    print(f"{'page':<10} {'fields':>7} {'__dict__':>12} {'compiled':>12} {'speedup':>8}")
+    physics, pages = sample_pages(random.Random(2022))
+    for page, (data, old, skip) in pages.items():
+        expected = old(data, {})
+        assert new_page(data, skip).as_dict() == expected, page
+        old_rate = 1 / per_sample(lambda: old(data, {}), number)
+        new_rate = 1 / per_sample(lambda: new_page(data, skip), number)
+        print(f"{page:<10} {len(expected):>7} {old_rate:8.0f} /s {new_rate:8.0f} /s {new_rate / old_rate:7.1f}x")
+
+    # Parse and flatten against one unpack from the mapping
+    layout = PageLayout(PHYSICS_FIELDS, extra={"driver_name": NAME})
+    assert list(layout.snapshot(physics).items()) == list(new_page(read_physic_map(physics)).items())
+    parsed_rate = 1 / per_sample(lambda: new_page(read_physic_map(physics)), number)
+    layout_rate = 1 / per_sample(lambda: layout.snapshot(physics), number)
+    print(f"physics read and flatten: parsed {parsed_rate:8.0f} /s  layout {layout_rate:8.0f} /s {layout_rate / parsed_rate:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
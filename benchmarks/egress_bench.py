@@ -0,0 +1,73 @@
+# End-to-end throughput of the egress senders against the local fake
+# collector. Run from the repository root: python -m benchmarks.egress_bench
+import argparse
+import time
+import signalfx  # type: ignore
+from telemetry.collector import FakeCollector, print_stats
+from telemetry.egress import HecSender, GaugeSender, describe_wire
+
+event = {
+    "time": 1650000000,
+    "event": "metric",
+    "sourcetype": "f1_2021_telemetry",
+    "host": "bench",
+    "source": "metrics",
+    "fields": {"metric_name:f1_2021.speed": 287, "metric_name:f1_2021.engineRPM": 11250},
+}
+
+metrics = ["f1_2021.speed", "f1_2021.engineRPM", "f1_2021.gear", "f1_2021.brake"]
+dimensions = {"driver": "bench", "track": "Monza"}
+
+
+def wait_for(sender, total, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = sender.stats()
+        if stats["sent"] + stats["failed"] + stats["dropped"] >= total:
+            return
+        time.sleep(0.01)
+
+
+def bench_hec(collector, packets, gzip_level=0, max_bytes=0):
+    hec = HecSender(f"http://127.0.0.1:{collector.server_port}/services/collector", "bench", max_queue=packets, gzip_level=gzip_level, max_bytes=max_bytes)
+    start = time.perf_counter()
+    for i in range(packets):
+        hec.send(event)
+    wait_for(hec, packets)
+    elapsed = time.perf_counter() - start
+    hec.stop()
+    stats = hec.stats()
+    print(f"HEC       {packets / elapsed:.0f} events/s {describe_wire(stats, {}, elapsed)} {stats}")
+
+
+def bench_o11y(collector, packets):
+    ingest = signalfx.SignalFx(ingest_endpoint=f"http://127.0.0.1:{collector.server_port}").ingest("bench")
+    o11y = GaugeSender(ingest, max_queue=packets)
+    start = time.perf_counter()
+    for i in range(packets):
+        o11y.send_values(metrics, (287, 11250, 7, 0.25), dimensions)
+    wait_for(o11y, packets)
+    ingest.stop()
+    elapsed = time.perf_counter() - start
+    o11y.stop()
+    print(f"O11y      {packets / elapsed:.0f} packets/s {o11y.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Egress throughput against the fake collector")
+    parser.add_argument("-n", "--packets", type=int, default=20000, help="Packets to send through each sender")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the collector adds to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests the collector fails")
+    parser.add_argument("--gzip", type=int, default=0, help="gzip level for HEC bodies, 0 for none")
+    parser.add_argument("--max-bytes", type=int, default=0, help="Uncompressed bytes per HEC request, 0 for no limit")
+    args = parser.parse_args()
+
+    collector = FakeCollector(("127.0.0.1", 0), args.latency, args.error_rate).start()
+    bench_hec(collector, args.packets, args.gzip, args.max_bytes)
+    bench_o11y(collector, args.packets)
+    print_stats(collector.stats())
+    collector.shutdown()
+
+
+if __name__ == "__main__":
+    main()
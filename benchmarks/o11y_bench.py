@@ -0,0 +1,109 @@
+# O11y requests per second of the F1 2022 listener in spectator mode against
+# the local fake collector: every car of a packet sent with its own
+# ingest.send and a freshly built dimension dict, as the listener used to,
+# against the gauges of all cars with cached dimension dicts handed to a
+# GaugeSender once per packet, which merges consecutive packets into one
+# ingest.send. Packets are produced at --rate per second like the game does.
+# Reported are the ingest.send calls and the HTTP requests the SignalFx client
+# made of them (it packs up to 300 queued datapoints into one request), and
+# the time a packet spends handing its gauges over.
+# Run from the repository root: python -m benchmarks.o11y_bench
+import argparse
+import time
+import signalfx  # type: ignore
+from telemetry.collector import FakeCollector
+from telemetry.egress import GaugeSender
+
+CARS = 22
+metrics = ["speed", "engine_rpm", "throttle", "brakes_temperature1"]
+
+
+# An ingest client that counts its send calls
+def counting(ingest):
+    send = ingest.send
+    ingest.sends = 0
+
+    def counted(**kwargs):
+        ingest.sends += 1
+        return send(**kwargs)
+
+    ingest.send = counted
+    return ingest
+
+
+def packet(number):
+    return [({metric: number + car for metric in metrics}, {"name": f"Driver {car}", "player_name": "bench"}) for car in range(CARS)]
+
+
+def per_car(ingest, rows):
+    for f1_metrics, f1_dimensions in rows:
+        f1_dimensions = dict(f1_dimensions)
+        f1_dimensions["f1-2022-hostname"] = "bench"
+        ingest.send(gauges=[{"metric": "f1_2022." + key, "value": value, "dimensions": f1_dimensions} for key, value in f1_metrics.items()])
+
+
+def coalesced(o11y, rows, cache, names):
+    gauges = []
+    for f1_metrics, f1_dimensions in rows:
+        key = tuple(f1_dimensions.items())
+        dimensions = cache.get(key)
+        if dimensions is None:
+            dimensions = cache[key] = dict(f1_dimensions, **{"f1-2022-hostname": "bench"})
+        gauges.extend({"metric": names[key], "value": value, "dimensions": dimensions} for key, value in f1_metrics.items())
+    o11y.send(gauges)
+
+
+# Sends packets at rate per second for seconds, returns the caller time per packet
+def replay(send, rate, seconds):
+    packets = int(rate * seconds)
+    spent = 0.0
+    start = time.perf_counter()
+    for number in range(packets):
+        rows = packet(number)
+        due = start + number / rate
+        now = time.perf_counter()
+        if due > now:
+            time.sleep(due - now)
+        began = time.perf_counter()
+        send(rows)
+        spent += time.perf_counter() - began
+    return spent / packets
+
+
+def report(label, ingest, collector, per_packet, seconds):
+    counters = collector.stats()["counters"]["datapoint"]
+    print(
+        f"{label:<10} {ingest.sends / seconds:8.1f} sends/s {counters['requests'] / seconds:8.1f} requests/s "
+        + f"{counters['events'] / seconds:9.0f} datapoints/s {per_packet * 1e6:7.0f} us/packet"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="O11y requests per second, per-car sends against coalesced gauges")
+    parser.add_argument("--rate", type=float, default=60, help="Packets per second")
+    parser.add_argument("--seconds", type=float, default=5, help="Seconds to send for")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the collector adds to every response")
+    args = parser.parse_args()
+
+    collector = FakeCollector(("127.0.0.1", 0), args.latency).start()
+    endpoint = f"http://127.0.0.1:{collector.server_port}"
+
+    ingest = counting(signalfx.SignalFx(ingest_endpoint=endpoint).ingest("bench"))
+    per_packet = replay(lambda rows: per_car(ingest, rows), args.rate, args.seconds)
+    ingest.stop()
+    report("per car", ingest, collector, per_packet, args.seconds)
+
+    collector.reset()
+    ingest = counting(signalfx.SignalFx(ingest_endpoint=endpoint).ingest("bench"))
+    o11y = GaugeSender(ingest, max_events=50, max_linger=0.1)
+    cache = {}
+    names = {metric: "f1_2022." + metric for metric in metrics}
+    per_packet = replay(lambda rows: coalesced(o11y, rows, cache, names), args.rate, args.seconds)
+    o11y.stop()
+    ingest.stop()
+    report("coalesced", ingest, collector, per_packet, args.seconds)
+    collector.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Highest packet rate the F1 2022 receive loop sustains without loss: a
+# capture is replayed with the replay tool at increasing speeds to a receive
+# loop that hands datagrams to a decode thread, once reading one datagram per
+# wakeup as bytes and once draining batches into the preallocated buffer ring.
+# Run from the repository root:
+# python -m benchmarks.receive_bench -i race.f1cap --speeds 20,50,100,200
+import argparse
+import queue
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+from f1_22_telemetry.packets import PacketHeader, HEADER_FIELD_TO_PACKET_TYPE  # type: ignore
+from telemetry.capture import read_capture
+from telemetry.receiver import BufferRing, BatchReceiver
+
+
+def unpack_packet(datagram):
+    header = PacketHeader.from_buffer_copy(datagram)
+    return HEADER_FIELD_TO_PACKET_TYPE[(header.packet_format, header.packet_version, header.packet_id)].unpack(datagram)
+
+
+# Receive until stopped, returns the number of datagrams decoded
+def run_receiver(sock, batch, stopped, counts):
+    tasks = queue.Queue(maxsize=1000)
+    ring = BufferRing() if batch else None
+
+    def decode():
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            if ring is None:
+                unpack_packet(item)
+                counts["decoded"] += 1
+                continue
+            for slot, datagram in item:
+                unpack_packet(datagram)
+                ring.release(slot)
+                counts["decoded"] += 1
+
+    decoder = threading.Thread(target=decode, daemon=True)
+    decoder.start()
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    receiver = BatchReceiver(sock, ring, batch) if batch else None
+    while not stopped.is_set():
+        if not selector.select(0.1):
+            continue
+        if receiver is None:
+            item = sock.recv(2048)
+            counts["received"] += 1
+        else:
+            item = receiver.receive()
+            if not item:
+                time.sleep(0.001)
+                continue
+            counts["received"] += len(item)
+        try:
+            tasks.put_nowait(item)
+        except queue.Full:
+            counts["dropped"] += 1 if receiver is None else len(item)
+            if receiver is not None:
+                ring.release_all(item)
+    tasks.put(None)
+    decoder.join()
+
+
+def measure(capture, packets, speed, loops, batch):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    counts = {"received": 0, "decoded": 0, "dropped": 0}
+    stopped = threading.Event()
+    thread = threading.Thread(target=run_receiver, args=(sock, batch, stopped, counts), daemon=True)
+    thread.start()
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "telemetry.capture", "replay", "-i", capture, "-p", str(port), "--speed", str(speed), "--loops", str(loops)], check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    time.sleep(1)
+    stopped.set()
+    thread.join()
+    sock.close()
+    sent = packets * loops
+    return sent / elapsed, (sent - counts["decoded"]) / sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Highest loss free packet rate of the receive loop")
+    parser.add_argument("-i", "--input", required=True, help="Capture file to replay")
+    parser.add_argument("--speeds", default="10,20,50,100,200", help="Comma separated replay speeds to try")
+    parser.add_argument("--seconds", type=float, default=5, help="Approximate seconds to replay at every speed")
+    parser.add_argument("--batch", type=int, default=64, help="Datagrams per wakeup in batch mode")
+    parser.add_argument("--max-loss", type=float, default=0.001, help="Loss ratio still counted as sustained")
+    args = parser.parse_args()
+
+    capture = list(read_capture(args.input))
+    duration = capture[-1][0] - capture[0][0]
+    for label, batch in (("recv", 0), (f"batch {args.batch}", args.batch)):
+        sustained = 0.0
+        for speed in (float(speed) for speed in args.speeds.split(",")):
+            loops = max(1, round(args.seconds * speed / duration))
+            rate, loss = measure(args.input, len(capture), speed, loops, batch)
+            print(f"{label:<10} speed {speed:>6g} {rate:9.0f} packets/s loss {loss * 100:6.2f}%")
+            if loss <= args.max_loss:
+                sustained = max(sustained, rate)
+        print(f"{label:<10} sustained {sustained:.0f} packets/s")
+
+
+if __name__ == "__main__":
+    main()
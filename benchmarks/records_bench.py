@@ -0,0 +1,121 @@
+# Per-packet cost of turning an F1 2022 packet into HEC bytes, the original
+# to_json() -> json.loads() -> flatten -> str() -> json.dumps() path against
+# the compiled record layouts and HecEncoder, read struct by struct and, when
+# NumPy is installed, column by column. All produce identical bytes. The
+# last columns are the cost and size of the same rows as multi-metric events,
+# checked against json.dumps of every event.
+# Run from the repository root: python -m benchmarks.records_bench
+import ctypes
+import json
+import random
+import timeit
+from f1_22_telemetry import packets  # type: ignore
+from telemetry.records import HecEncoder, MetricEncoder, array_records, field_value, layout_for, numpy
+
+TIMESTAMP = 1650000000.123456
+
+# packet id: packet class, per-car array, packet level fields added to every row
+PACKETS = {
+    0: (packets.PacketMotionData, "car_motion_data", ()),
+    1: (packets.PacketSessionData, "marshal_zones", ("air_temperature", "track_id", "weather", "total_laps", "track_temperature", "track_length")),
+    2: (packets.PacketLapData, "lap_data", ()),
+    4: (packets.PacketParticipantsData, "participants", ()),
+    5: (packets.PacketCarSetupData, "car_setups", ()),
+    6: (packets.PacketCarTelemetryData, "car_telemetry_data", ()),
+    7: (packets.PacketCarStatusData, "car_status_data", ()),
+    8: (packets.PacketFinalClassificationData, "classification_data", ("num_cars",)),
+    9: (packets.PacketLobbyInfoData, "lobby_players", ("num_players",)),
+    10: (packets.PacketCarDamageData, "car_damage_data", ()),
+    11: (packets.PacketSessionHistoryData, "lap_history_data", ()),
+}
+
+
+# A packet of random bytes with readable, awkward driver names
+def random_packet(cls, field, rng):
+    packet = cls.from_buffer_copy(bytes(rng.getrandbits(8) for _ in range(ctypes.sizeof(cls))))
+    for index, car in enumerate(getattr(packet, field)):
+        if hasattr(car, "name"):
+            car.name = f'Pérez "{index}" \\ %s'.encode()
+    return packet
+
+
+def old_flatten(data):
+    blank_list = []
+    car_index = 0
+    for entry in data:
+        blank_dict = {}
+        blank_dict.update({element: entry[element] for element in entry if not isinstance(entry[element], list)})
+        multi_value_fields = {element: {element + str(ind + 1): value for ind, value in enumerate(entry[element])} for element in entry if isinstance(entry[element], list)}
+        for field in multi_value_fields:
+            blank_dict.update(multi_value_fields[field])
+        blank_dict.update({"car_index": car_index})
+        car_index += 1
+        blank_list = blank_list + [blank_dict]
+    return blank_list
+
+
+def old_path(packet, field, extras):
+    data = json.loads(packet.to_json())
+    rows = old_flatten(data[field])
+    for entry in rows:
+        entry.update(data["header"])
+        for a in extras:
+            entry.update({a: data[a]})
+    rows = [{key: str(row[key]) for key in row.keys()} for row in rows]
+    events = [json.dumps({"time": TIMESTAMP, "sourcetype": "bench", "source": "f1_2022", "host": "bench", "event": row}) for row in rows]
+    return "\n".join(events).encode()
+
+
+encoder = HecEncoder("f1_2022", "bench")
+metric_encoder = MetricEncoder("f1_2022.", "f1_2022", "bench", ("name", "car_index"), ("frame_identifier", "session_time"))
+
+
+def new_path(packet, field, extras, columnar=False, encoder=encoder):
+    header = layout_for(packets.PacketHeader).record(packet.header)
+    extra_values = {a: field_value(packet, a) for a in extras}
+    rows = array_records(packet, field, columnar)
+    for car_index, entry in enumerate(rows):
+        entry["car_index"] = car_index
+        entry.update(header)
+        entry.update(extra_values)
+    return encoder.encode(rows, "bench", TIMESTAMP)
+
+
+# The same rows as multi-metric events serialised one json.dumps at a time
+def dumped_metrics(packet, field, extras):
+    header = layout_for(packets.PacketHeader).record(packet.header)
+    extra_values = {a: field_value(packet, a) for a in extras}
+    rows = array_records(packet, field)
+    for car_index, entry in enumerate(rows):
+        entry["car_index"] = car_index
+        entry.update(header)
+        entry.update(extra_values)
+    return "\n".join(metric_encoder.slow_event(row, "bench", TIMESTAMP) for row in rows).encode()
+
+
+def per_packet(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(number=200):
+    rng = random.Random(2022)
+    print(f"{'packet':<32} {'to_json':>10} {'records':>10} {'metrics':>10} {'event B':>10} {'metric B':>10} {'columnar':>10}")
+    for packet_id, (cls, field, extras) in PACKETS.items():
+        packet = random_packet(cls, field, rng)
+        expected = old_path(packet, field, extras)
+        assert new_path(packet, field, extras) == expected, cls.__name__
+        assert new_path(packet, field, extras, encoder=metric_encoder) == dumped_metrics(packet, field, extras), cls.__name__
+        old = per_packet(lambda: old_path(packet, field, extras), number)
+        new = per_packet(lambda: new_path(packet, field, extras), number)
+        metrics = per_packet(lambda: new_path(packet, field, extras, encoder=metric_encoder), number)
+        metric_bytes = len(new_path(packet, field, extras, encoder=metric_encoder))
+        line = f"{packet_id:>2} {cls.__name__:<29} {old * 1e6:7.0f} us {new * 1e6:7.0f} us {metrics * 1e6:7.0f} us {len(expected):8d} B {metric_bytes:8d} B"
+        if numpy is not None:
+            assert new_path(packet, field, extras, True) == expected, cls.__name__
+            columnar = per_packet(lambda: new_path(packet, field, extras, True), number)
+            line += f" {columnar * 1e6:7.0f} us"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Per-packet cost of building the O11y datapoints for car telemetry, the
+# original list of 16 datapoint dicts against the MetricSchema snapshot.
+# Run from the repository root: python -m benchmarks.schema_bench
+import sys
+import timeit
+import tracemalloc
+from telemetry_f1_2021.packets import CarTelemetryData
+from telemetry.splunk import telemetry_schema
+
+dimensions = {"driver": "bench", "track": "Monza"}
+
+car = CarTelemetryData()
+car.m_speed = 287
+car.m_engine_rpm = 11250
+car.m_gear = 7
+car.m_brake = 0.25
+for i in range(4):
+    car.m_brakes_temperature[i] = 640 + i
+    car.m_tyres_surface_temperature[i] = 95 + i
+    car.m_tyres_inner_temperature[i] = 101 + i
+
+
+def dict_list(car_telemetry_data):
+    return [
+        {"metric": "f1_2021.speed", "value": car_telemetry_data.m_speed, "dimensions": dimensions},
+        {"metric": "f1_2021.engineRPM", "value": car_telemetry_data.m_engine_rpm, "dimensions": dimensions},
+        {"metric": "f1_2021.gear", "value": car_telemetry_data.m_gear, "dimensions": dimensions},
+        {"metric": "f1_2021.brake", "value": car_telemetry_data.m_brake, "dimensions": dimensions},
+        {"metric": "f1_2021.brakeTempFL", "value": car_telemetry_data.m_brakes_temperature[0], "dimensions": dimensions},
+        {"metric": "f1_2021.brakeTempFR", "value": car_telemetry_data.m_brakes_temperature[1], "dimensions": dimensions},
+        {"metric": "f1_2021.brakeTempRL", "value": car_telemetry_data.m_brakes_temperature[2], "dimensions": dimensions},
+        {"metric": "f1_2021.brakeTempRR", "value": car_telemetry_data.m_brakes_temperature[3], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresSurfaceTempFL", "value": car_telemetry_data.m_tyres_surface_temperature[0], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresSurfaceTempFR", "value": car_telemetry_data.m_tyres_surface_temperature[1], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresSurfaceTempRL", "value": car_telemetry_data.m_tyres_surface_temperature[2], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresSurfaceTempRR", "value": car_telemetry_data.m_tyres_surface_temperature[3], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresInnerTempFL", "value": car_telemetry_data.m_tyres_inner_temperature[0], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresInnerTempFR", "value": car_telemetry_data.m_tyres_inner_temperature[1], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresInnerTempRL", "value": car_telemetry_data.m_tyres_inner_temperature[2], "dimensions": dimensions},
+        {"metric": "f1_2021.tyresInnerTempRR", "value": car_telemetry_data.m_tyres_inner_temperature[3], "dimensions": dimensions},
+    ]
+
+
+def schema_snapshot(car_telemetry_data):
+    return telemetry_schema.read(car_telemetry_data)
+
+
+# Bytes and memory blocks still held by what one call returns, i.e. what sits
+# in the sender queue per packet, averaged over a queue's worth of packets so
+# free lists don't hide the allocations
+def retained(func, packets=1000):
+    results = [None] * packets
+    tracemalloc.start()
+    size = tracemalloc.get_traced_memory()[0]
+    blocks = sys.getallocatedblocks()
+    for i in range(packets):
+        results[i] = func(car)
+    blocks = sys.getallocatedblocks() - blocks
+    size = tracemalloc.get_traced_memory()[0] - size
+    tracemalloc.stop()
+    return size // packets, blocks // packets
+
+
+def main(number=100000):
+    # repr as well, so an int shipped as a float (3 against 3.0) fails too
+    assert repr(telemetry_schema.gauges(schema_snapshot(car), dimensions)) == repr(dict_list(car))
+    for label, func in (("dict list", dict_list), ("schema", schema_snapshot)):
+        seconds = min(timeit.repeat(lambda: func(car), number=number, repeat=5))
+        size, blocks = retained(func)
+        print(f"{label:<10} {seconds / number * 1e6:7.2f} us/packet {blocks:4d} blocks {size:6d} bytes per packet")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,91 @@
 #!/usr/bin/env python3
 import os
+import socket
 import time
+import selectors
+import signal
+import threading
+import multiprocessing
+import itertools
 import signalfx # type: ignore
 import configparser
 import argparse
 import json
-import requests # type: ignore
-import background # type: ignore
 import urllib3 # type: ignore
 from datetime import datetime
 from f1_22_telemetry.listener import TelemetryListener # type: ignore
-from requests.adapters import HTTPAdapter # type: ignore
+from f1_22_telemetry.packets import PacketHeader, HEADER_FIELD_TO_PACKET_TYPE # type: ignore
 from rich import print # type: ignore
 from rich.panel import Panel # type: ignore
 from rich.layout import Layout # type: ignore
-from rich.live import Live # type: ignore
 import sqlite3
+from telemetry.emission import EmissionPolicy, AggregateRule, AGGREGATE_SUFFIXES
+from telemetry.egress import HecSender, GaugeSender, describe_wire
+from telemetry.spool import Spool
+from telemetry.console import Console
+from telemetry.players import PlayerRegistry
+from telemetry.executor import Executor, describe_executors
+from telemetry.receiver import BufferRing, BatchReceiver
+from telemetry.sequence import SequenceTracker, sequence_samples, set_receive_buffer
+from telemetry.instrument import Registry, SelfMetrics, serve_metrics, watch_sender, watch_executor
+from telemetry.records import HecEncoder, MetricEncoder, layout_for, array_records, field_value, numpy
 
 layout = Layout()
 
 urllib3.disable_warnings()
-background.n = 100
 
 database = "players.sqlite"
 
 # mode should be 'spectator' to grab all cars, 'solo' to only grab data for the player car
 parser = argparse.ArgumentParser(description="F1 2022 - Splunk Data Drivers")
 parser.add_argument("--hostname", help="Hostname", default="rig_1")
+parser.add_argument("-a", "--all-rigs", help="Listen for every rig in the players table in this one process", action="store_true")
+parser.add_argument("--bind", help="Address the UDP ports are bound to", default="localhost")
+parser.add_argument("-w", "--workers", help="Decode packets in this many worker processes instead of threads", type=int, default=0)
+parser.add_argument("-b", "--batch", help="Drain up to this many datagrams per wakeup into preallocated buffers", type=int, default=0)
+parser.add_argument("--columnar", help="Decode the per-car arrays a column at a time with NumPy", action="store_true")
+parser.add_argument("--headless", help="Run without the console, for servers", action="store_true")
 parser.add_argument("-e", "--endpoint", help="Send data to Splunk Core, O11y Cloud or both", choices=["core", "o11y", "both"], default="both")
 parser.add_argument("-m", "--mode", help="Spectator or Solo Mode", choices=["spectator", "solo"], default="solo")
 args = vars(parser.parse_args())
 
-hostname = args["hostname"]
+if args["columnar"] and numpy is None:
+    parser.error("--columnar needs NumPy, install it with pip install numpy")
+
+
+
+# Per-rig state: every rig has its own UDP port, player, participants and lap
+# event buffer, everything else is shared by all rigs of the process
+class Rig:
+    def __init__(self, player_name, hostname, port):
+        self.player_name = player_name
+        self.hostname = hostname
+        self.udp_port = int(port)
+        self.player_info = [{"ai_controlled": 1, "driver_id": 63, "name": "", "nationality": 13, "race_number": 6, "team_id": 3, "your_telemetry": 1}]
+        self.lap_info = [{"current_sector": 0, "current_lap": 1, "lap_event": "none", "lap_event_count": 0} for i in range(22)]
+        self.hec_encoder = HecEncoder("f1_2022", hostname)
+        # O11y dimension dicts by dimension values, shared by every gauge of a car
+        self.dimensions = {}
+        self.sequence = SequenceTracker(PacketHeader, "session_uid", "frame_identifier", "packet_id")
+
 
 conn = sqlite3.connect(database, check_same_thread=False)
-get_players = conn.execute("SELECT player_name, hostname, port FROM players WHERE hostname = ?", (hostname,))
-rows = get_players.fetchone()
+if args["all_rigs"]:
+    get_players = conn.execute("SELECT player_name, hostname, port FROM players ORDER BY port")
+else:
+    get_players = conn.execute("SELECT player_name, hostname, port FROM players WHERE hostname = ?", (args["hostname"],))
+rigs = [Rig(*row) for row in get_players.fetchall()]
 conn.close()
 
+if not rigs:
+    parser.error(f"No players found in {database}")
+
 #conn.execute("UPDATE players SET listener_pid = ? WHERE hostname = ?", (1, hostname))
 #conn.commit()
 
-player_name = rows[0]
 mode = args["mode"]
-udp_port = int(rows[2])
 endpoint = args["endpoint"]
 
-sesh = requests.Session()
-# retries = Retry(total=10, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-sesh.mount("https://", HTTPAdapter(pool_connections=100, pool_maxsize=100, max_retries=0, pool_block=False))
-
 # Open config file for read
 config = configparser.ConfigParser()
 config.read("settings.ini")
@@ -68,6 +104,15 @@ car_telemetry = config.getboolean("telemetry", "car_telemetry")
 lap_data = config.getboolean("telemetry", "lap_data")
 car_status = config.getboolean("telemetry", "car_status")
 car_setup = config.getboolean("telemetry", "car_setup")
+player_flush_interval = config.getfloat("telemetry", "player_flush_interval", fallback=1.0)
+stats_interval = config.getfloat("telemetry", "stats_interval", fallback=0)
+metrics_port = config.getint("telemetry", "metrics_port", fallback=0)
+metrics_bind = config.get("telemetry", "metrics_bind", fallback="127.0.0.1")
+self_metrics_interval = config.getfloat("telemetry", "self_metrics_interval", fallback=0)
+# Receive buffer of the UDP sockets in bytes, 0 for the OS default
+udp_rcvbuf = config.getint("telemetry", "udp_rcvbuf", fallback=0)
+# Receive buffers shared by the rigs in --batch mode, 2 KiB each
+udp_ring_slots = config.getint("telemetry", "udp_ring_slots", fallback=4096)
 
 sim_metrics = []
 
@@ -76,6 +121,13 @@ sim_metrics = []
 
 sim_metrics = [metric for metric in config["sim_metrics"].values()]
 
+# Per-metric emission policy, see telemetry/emission.py for the rule syntax
+emission_rules = dict(config.items("emission")) if config.has_section("emission") else {}
+emission = EmissionPolicy(emission_rules, emission_rules.pop("default", "all"))
+
+# Aggregated metrics are renamed to <metric>_min/_max/_avg, send those to O11y too
+sim_metric_keys = sim_metrics + [metric + suffix for metric in sim_metrics if isinstance(emission.rule_for(metric), AggregateRule) for suffix in AGGREGATE_SUFFIXES]
+
 packet_dict = {}
 
 for key, packet_ids in config.items("packet_ids"):
@@ -84,13 +136,66 @@ for key, packet_ids in config.items("packet_ids"):
 client = signalfx.SignalFx(ingest_endpoint=sim_endpoint)
 ingest = client.ingest(sim_token)
 
+# Gauges of every car and of consecutive packets are merged into one ingest.send
+o11y = GaugeSender(
+    ingest,
+    max_queue=config.getint("ingest", "o11y_queue_size", fallback=10000),
+    max_events=config.getint("ingest", "o11y_batch_size", fallback=50),
+    max_linger=config.getfloat("ingest", "o11y_linger", fallback=0.1),
+)
+
+# HEC output: "events" sends every row as a raw event with string values,
+# "metrics" as a multi-metric event for a metrics index with numeric values
+hec_format = config.get("ingest", "hec_format", fallback="events")
+if hec_format not in ("events", "metrics"):
+    parser.error(f"hec_format must be events or metrics, not {hec_format}")
+
+# Identity of a car in metrics format, and per-packet fields that would only add cardinality
+metric_dimensions = ["name", "player_name", "car_index", "team_id", "race_number", "driver_id", "nationality", "ai_controlled", "network_id", "session_uid", "lap_event"]
+metric_skip = [
+    "packet_format", "game_major_version", "game_minor_version", "packet_version", "packet_id", "session_time", "frame_identifier",
+    "player_car_index", "secondary_player_car_index", "your_telemetry", "lap_event_count", "checkpoint_1", "checkpoint_3_payload_processed",
+]
+
+for rig in rigs:
+    rig.metric_encoder = MetricEncoder("f1_2022.", "f1_2022", rig.hostname, metric_dimensions, metric_skip, config.get("ingest", "hec_metrics_index", fallback=None))
+
+# One batching HEC pipeline shared by every rig, events carry their rig's
+# hostname. Batches are spooled to hec_spool_dir while HEC is unreachable.
+hec_spool = None
+if config.get("ingest", "hec_spool_dir", fallback=""):
+    hec_spool = Spool(config.get("ingest", "hec_spool_dir"), config.getint("ingest", "hec_spool_max_mb", fallback=256) * 1024 * 1024)
+
+hec = HecSender(
+    splunk_hec_ip + ":" + splunk_hec_port + "/services/collector",
+    splunk_hec_token,
+    verify=False,
+    spool=hec_spool,
+    drain_rate=config.getfloat("ingest", "hec_spool_drain_rate", fallback=5.0),
+    max_queue=config.getint("ingest", "hec_queue_size", fallback=20000),
+    max_events=config.getint("ingest", "hec_batch_size", fallback=500),
+    max_linger=config.getfloat("ingest", "hec_linger", fallback=0.5),
+    max_bytes=config.getint("ingest", "hec_batch_bytes", fallback=0),
+    gzip_level=config.getint("ingest", "hec_gzip_level", fallback=0),
+)
+
 layout.split_column(Layout(name="upper", size=9), Layout(name="lower"))
 layout["upper"].split_row(
     Layout(name="top_left"),
     Layout(name="top_right"),
 )
 
-layout["top_left"].update(Layout(Panel(f"\nHostname: [b yellow]{hostname}[/b yellow]\n\nUDP Port: [b orange_red1]{udp_port}[/b orange_red1]\n\nPlayer Name: [magenta1]{player_name}", title="[b cyan]Current Player", title_align="left")))
+
+def update_players_panel():
+    if len(rigs) == 1:
+        rig = rigs[0]
+        players = f"\nHostname: [b yellow]{rig.hostname}[/b yellow]\n\nUDP Port: [b orange_red1]{rig.udp_port}[/b orange_red1]\n\nPlayer Name: [magenta1]{rig.player_name}"
+    else:
+        players = "".join(f"\n[b yellow]{rig.hostname}[/b yellow] [b orange_red1]{rig.udp_port}[/b orange_red1] [magenta1]{rig.player_name}[/magenta1]" for rig in rigs)
+    layout["top_left"].update(Layout(Panel(players, title="[b cyan]Current Player", title_align="left")))
+
+
+update_players_panel()
 
 layout["lower"].update(
     Layout(
@@ -114,104 +219,87 @@ layout["top_right"].update(Layout(Panel("\n[i bright_red]Awaiting Player data ..
 #########################################
 # Set up global variables and data stores
 
-player_info = [{"ai_controlled": 1, "driver_id": 63, "name": "", "nationality": 13, "race_number": 6, "team_id": 3, "your_telemetry": 1}]
-
-lap_info = []
+sim_dimensions = ["name", "player_name"]
 
-for i in range(1, 21):
-    lap_info = lap_info + [{"current_sector": 0, "current_lap": 1, "lap_event": "none", "lap_event_count": 0}]
 
-sim_dimensions = ["name", "player_name"]
+# Offset of packet_id in the packet header, used to shard datagrams before decoding
+PACKET_ID_OFFSET = PacketHeader.packet_id.offset
 
 
 def lookup_packet_id(packet_id):
     return packet_dict[packet_id]
 
 
-# Sends metrics to O11y Cloud
-def send_metric(f1_metrics, f1_dimensions):
-    telemetry_json = []
-    f1_dimensions["f1-2022-hostname"] = hostname
+o11y_metric_names = {key: "f1_2022." + key for key in sim_metric_keys}
 
-    for key, value in f1_metrics.items():
-        telemetry_json.append({"metric": "f1_2022." + key, "value": value, "dimensions": f1_dimensions})
 
-    ingest.send(gauges=telemetry_json)
+# Dimension dict of a car, built once per rig and distinct dimension values
+def car_dimensions(rig, dimension_values):
+    try:
+        return rig.dimensions[dimension_values]
+    except KeyError:
+        dimensions = dict(dimension_values)
+        dimensions["f1-2022-hostname"] = rig.hostname
+        if len(rig.dimensions) > 1024:
+            rig.dimensions.clear()
+        rig.dimensions[dimension_values] = dimensions
+        return dimensions
 
 
-def send_dims_and_metrics(f1_json):
-    dimensions = [{key: car_dict[key] for key in sim_dimensions if key in car_dict} for car_dict in f1_json]
+# Picks the O11y metrics and dimension values of every car that has at least one metric
+def select_dims_and_metrics(f1_json):
+    dimensions = [tuple((key, car_dict[key]) for key in sim_dimensions if key in car_dict) for car_dict in f1_json]
 
-    metrics = [{key: car_dict[key] for key in sim_metrics if key in car_dict} for car_dict in f1_json]
+    metrics = [{key: car_dict[key] for key in sim_metric_keys if key in car_dict} for car_dict in f1_json]
 
-    for f1_metrics, f1_dimensions in zip(metrics, dimensions):
-        if len(f1_metrics) >= 1:
-            # Send current row to O11y Cloud
-            send_metric(f1_metrics, f1_dimensions)
+    return [(f1_metrics, f1_dimensions) for f1_metrics, f1_dimensions in zip(metrics, dimensions) if len(f1_metrics) >= 1]
 
 
-# Function to send raw unprocessed event to HEC
-@background.task
-def send_hec_json(data, packet_id):
-    hec_payload = ""
+# Sends the gauges of every car of a packet to O11y Cloud as one batch
+def send_dims_and_metrics(rig, o11y_rows):
+    gauges = []
+    for f1_metrics, dimension_values in o11y_rows:
+        f1_dimensions = car_dimensions(rig, dimension_values)
+        gauges.extend({"metric": o11y_metric_names[key], "value": value, "dimensions": f1_dimensions} for key, value in f1_metrics.items())
+    o11y.send(gauges)
 
+
+# HEC payload of a raw unprocessed event
+def hec_json_payload(rig, data, packet_id):
     event = {}
     event["time"] = datetime.now().timestamp()
     event["sourcetype"] = lookup_packet_id(packet_id)
     event["source"] = "f1_2022"
-    event["host"] = hostname
+    event["host"] = rig.hostname
     event["event"] = data
 
-    hec_payload = hec_payload + json.dumps(event)
-
-    url = splunk_hec_ip + ":" + splunk_hec_port + "/services/collector"
-    header = {"Authorization": "Splunk " + splunk_hec_token}
-
-    try:
-        response = sesh.post(url=url, data=hec_payload, headers=header, verify=False)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        print(err)
-        print("Packet ID affected: " + lookup_packet_id(packet_id))
-
+    return json.dumps(event).encode()
 
-# function to send multiple events to splunk enterprise env
-@background.task
-def send_hec_batch(event_rows, packet_id):
-    event_rows = [{key: str(dict[key]) for key in dict.keys()} for dict in event_rows]
 
-    hec_payload = ""
+# HEC payload of multiple events for splunk enterprise env, every field value sent as a string
+def hec_batch_payload(rig, event_rows, packet_id):
+    return rig.hec_encoder.encode(event_rows, lookup_packet_id(packet_id), datetime.now().timestamp())
 
-    for row in event_rows:
-        event = {}
-        event["time"] = datetime.now().timestamp()
-        event["sourcetype"] = lookup_packet_id(packet_id)
-        event["source"] = "f1_2022"
-        event["host"] = hostname
-        event["event"] = row
 
-        hec_payload = hec_payload + json.dumps(event)
-
-    url = splunk_hec_ip + ":" + splunk_hec_port + "/services/collector"
-    header = {"Authorization": "Splunk " + splunk_hec_token}
-
-    try:
-        response = sesh.post(url=url, data=hec_payload, headers=header, verify=False)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        print(err)
-        print("Packet ID affected: " + lookup_packet_id(packet_id))
+# HEC payload of the rows of a packet as multi-metric events, all cars in one payload
+def hec_metrics_payload(rig, rows, packet_id):
+    return rig.metric_encoder.encode(rows, lookup_packet_id(packet_id), datetime.now().timestamp())
 
 
 #########################################
 # Data Stream Management and Processing
-def update_player_info(data):
-    global player_info
-    player_info = data["participants"]
+def update_player_info(rig, participants):
+    rig.player_info = participants
+
+
+def update_console(rig, rpm, kph, gear, brake, throttle):
+    console.update("telemetry", (rig, rpm, kph, gear, brake, throttle))
+    player_registry.update(rig.hostname, int(throttle * 100), kph, int(brake * 100))
 
 
-def update_console(rpm, kph, gear, brake, throttle):
-    global player_name
+# Rebuilds the telemetry panel from the latest values, on the console's refresh
+def render_telemetry(values):
+    rig, rpm, kph, gear, brake, throttle = values
     brake = brake * 100
     throttle = throttle * 100
     if gear == -1:
@@ -225,129 +313,87 @@ def update_console(rpm, kph, gear, brake, throttle):
                 + f"Current Gear:  [green_yellow]{gear}[/green_yellow]\n"
                 + f"Brake:    [dark_orange]{brake:.0f}%[/dark_orange]\n"
                 + f"Throttle: [dark_orange]{throttle:.0f}%[/dark_orange]",
-                title="[b cyan]Telemetry[/b cyan]",
+                title="[b cyan]Telemetry[/b cyan]" if len(rigs) == 1 else f"[b cyan]Telemetry {rig.hostname}[/b cyan]",
                 title_align="left",
             )
         )
     )
-    conn = sqlite3.connect(database, check_same_thread=False)
-    get_players = conn.execute("SELECT player_name, hostname, port FROM players WHERE hostname = ?", (hostname,))
-    rows = get_players.fetchone()
-    player_name = rows[0]
-    layout["top_left"].update(Layout(Panel(f"\nHostname: [b yellow]{hostname}[/b yellow]\n\nUDP Port: [b orange_red1]{udp_port}[/b orange_red1]\n\nPlayer Name: [magenta1]{player_name}", title="[b cyan]Current Player", title_align="left")))
-    conn.execute("UPDATE players SET throttle = ?, speed = ?, brake = ? WHERE hostname = ?", (int(throttle), kph, int(brake), hostname))
-    conn.commit()
-    conn.close()
 
-    return
 
+# Called by the player registry when the players table was changed elsewhere
+def update_player_names(names):
+    for rig in rigs:
+        rig.player_name = names.get(rig.hostname, rig.player_name)
+    console.update("players", names)
 
-# Flatten packet format
-def flatten_data(data):
-    blank_list = []
-    car_index = 0
-    for entry in data:
-        blank_dict = {}
-        blank_dict.update({element: entry[element] for element in entry if not isinstance(entry[element], list)})
-        multi_value_fields = {element: {element + str(ind + 1): value for ind, value in enumerate(entry[element])} for element in entry if isinstance(entry[element], list)}
 
-        for field in multi_value_fields:
-            blank_dict.update(multi_value_fields[field])
+console = Console(layout, refresh_per_second=4, headless=args["headless"])
+console.renderer("telemetry", render_telemetry)
+console.renderer("players", lambda names: update_players_panel())
 
-        blank_dict.update({"car_index": car_index})
-        car_index += 1
-        blank_list = blank_list + [blank_dict]
 
-    telemetry = blank_list
+# Per-car array and the packet level fields added to every row, per packet id
+packet_rows = {
+    0: ("car_motion_data", ()),
+    1: ("marshal_zones", ("air_temperature", "track_id", "weather", "total_laps", "track_temperature", "track_length")),
+    2: ("lap_data", ()),
+    4: ("participants", ()),
+    5: ("car_setups", ()),
+    6: ("car_telemetry_data", ()),
+    7: ("car_status_data", ()),
+    8: ("classification_data", ("num_cars",)),
+    9: ("lobby_players", ("num_players",)),
+    11: ("lap_history_data", ()),
+}
+
+
+# Flatten packet format, one record per car straight from the packet struct
+def flatten_data(packet, packet_id):
+    telemetry = array_records(packet, packet_rows[packet_id][0], args["columnar"])
+    for car_index, entry in enumerate(telemetry):
+        entry["car_index"] = car_index
 
     return telemetry
 
 
-def set_mode_data(telemetry, playerCarIndex):
+def set_mode_data(rig, telemetry, playerCarIndex):
     # If not in spectator mode, get rid of the non-player cars
     if mode == "solo":
         # get only player car from flattened data
         data = [telemetry[playerCarIndex]]
-        data[0].update({"player_name": player_name})
+        data[0].update({"player_name": rig.player_name})
     else:
         data = telemetry
 
     return data
 
 
-def augment_packet(header, telemetry, data, *args):
+def augment_packet(rig, header, telemetry, packet, packet_id):
     # Augment with header and player info data
-    for entry, player in zip(telemetry, player_info):
+    extras = {field: field_value(packet, field) for field in packet_rows[packet_id][1]}
+    for entry, player in zip(telemetry, rig.player_info):
         entry.update(player)
         entry.update(header)
-        # Augent with additional args
-        for a in args:
-            entry.update({a: data[a]})
+        # Augent with additional packet fields
+        entry.update(extras)
 
     return telemetry
 
 
-def merge_car_telemetry(data, header, playerCarIndex):
-    telemetry = flatten_data(data["car_telemetry_data"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data)
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
-
-def merge_car_setups(data, header, playerCarIndex):
-    telemetry = flatten_data(data["car_setups"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data)
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
-
-def merge_car_status(data, header, playerCarIndex):
-    telemetry = flatten_data(data["car_status_data"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data)
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
-
-def merge_session_history(data, header, playerCarIndex):
-    telemetry = flatten_data(data["lap_history_data"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data)
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
-
-def merge_session(data, header, playerCarIndex):
-    telemetry = flatten_data(data["marshal_zones"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data, "air_temperature", "track_id", "weather", "total_laps", "track_temperature", "track_length")
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
+# Car setups, telemetry, status, session, final classification, lobby and session history
+def merge_rows(rig, packet, packet_id, header, playerCarIndex):
+    telemetry = flatten_data(packet, packet_id)
 
-def merge_final(data, header, playerCarIndex):
-    telemetry = flatten_data(data["classification_data"])
+    augmented_telemetry = augment_packet(rig, header, telemetry, packet, packet_id)
 
-    augmented_telemetry = augment_packet(header, telemetry, data, "num_cars")
+    return set_mode_data(rig, augmented_telemetry, playerCarIndex)
 
-    return set_mode_data(augmented_telemetry, playerCarIndex)
 
-
-def merge_lobby(data, header, playerCarIndex):
-    telemetry = flatten_data(data["lobby_players"])
-
-    augmented_telemetry = augment_packet(header, telemetry, data, "num_players")
-
-    return set_mode_data(augmented_telemetry, playerCarIndex)
-
-
-def merge_car_motion(data, header, playerCarIndex):
-    telemetry = flatten_data(data["car_motion_data"])
+def merge_car_motion(rig, packet, header, playerCarIndex):
+    telemetry = flatten_data(packet, 0)
 
     # Augment with header and player info data
-    for entry, player in zip(telemetry, player_info):
+    for entry, player in zip(telemetry, rig.player_info):
         entry.update(player)
         entry.update(header)
 
@@ -355,7 +401,7 @@ def merge_car_motion(data, header, playerCarIndex):
     if mode != "spectator":
         # get only player car from flattened data
         telemetry = [telemetry[playerCarIndex]]
-        telemetry[0].update({"player_name": player_name})
+        telemetry[0].update({"player_name": rig.player_name})
         # Get additional motion data, not stored in the main array
         # Get the per-wheel motion data for the player car
         player_car_motion_list = [
@@ -367,23 +413,23 @@ def merge_car_motion(data, header, playerCarIndex):
         ]
         for motion_data in player_car_motion_list:
             i = 1
-            for value in data[motion_data]:
+            for value in getattr(packet, motion_data):
                 telemetry[0].update({motion_data + str(i): value})
                 i += 1
 
     return telemetry
 
 
-def merge_car_lap(data, header, playerCarIndex):
-    telemetry = flatten_data(data["lap_data"])
+def merge_car_lap(rig, packet, header, playerCarIndex):
+    telemetry = flatten_data(packet, 2)
 
     # Augment with header and player info data
-    for entry, player in zip(telemetry, player_info):
+    for entry, player in zip(telemetry, rig.player_info):
         entry.update(player)
         entry.update(header)
 
     # check for events such as lap or sector completeion
-    for entry, info_buffer in zip(telemetry, lap_info):
+    for entry, info_buffer in zip(telemetry, rig.lap_info):
         if info_buffer["current_lap"] < entry["current_lap_num"]:
             info_buffer.update({"lap_event": "LAP_COMPLETE", "lap_event_count": 0})
             entry.update({"lap_event": "LAP_COMPLETE"})
@@ -411,111 +457,405 @@ def merge_car_lap(data, header, playerCarIndex):
         info_buffer.update({"current_sector": entry["sector"], "current_lap": entry["current_lap_num"]})
         entry.update({"lap_event": info_buffer["lap_event"]})
 
-    return set_mode_data(telemetry, playerCarIndex)
+    return set_mode_data(rig, telemetry, playerCarIndex)
 
 
-def send_augmented_json(data, packet_id):
-    data.update({"player_name": player_name})
-    send_hec_json(data, packet_id)
+# Flatten and augment one packet. Returns (packet_id, rows, console) where
+# console holds the values for the telemetry panel, or None when the packet
+# has nothing to ship.
+def transform_packet(rig, packet):
+    console = None
+    header = layout_for(PacketHeader).record(packet.header)
+    packet_id = header["packet_id"]
+    playerCarIndex = header["player_car_index"]
 
+    if debug == True:
+        header.update({"checkpoint_1": time.time()})
 
-@background.task
-def massage_data(data):
-    dict_object = data.to_json()
-    data = json.loads(dict_object)
-    packet_id = data["header"]["packet_id"]
-    header = data["header"]
-    playerCarIndex = data["header"]["player_car_index"]
+    if packet_id == 3:
+        if args["endpoint"] == "core" or args["endpoint"] == "both":
+            # Event details are a union keyed by the event code, sent as the library formats them
+            data = json.loads(packet.to_json())
+            data.update({"player_name": rig.player_name})
+            return packet_id, [data], None
+        return
 
-    if debug == True:
-        data["header"].update({"checkpoint_1": time.time()})
+    if packet_id == 4:
+        update_player_info(rig, array_records(packet, "participants", args["columnar"]))
+        return
 
     if packet_id == 0:
         if car_motion == True:
-            merged_data = merge_car_motion(data, header, playerCarIndex)
+            merged_data = merge_car_motion(rig, packet, header, playerCarIndex)
         else:
             return
 
-    if packet_id == 1:
-        merged_data = merge_session(data, header, playerCarIndex)
-
-    if packet_id == 2:
+    elif packet_id == 2:
         if lap_data == True:
-            merged_data = merge_car_lap(data, header, playerCarIndex)
+            merged_data = merge_car_lap(rig, packet, header, playerCarIndex)
         else:
             return
 
-    if packet_id == 3:
-        try:
-            if args["endpoint"] == "core" or args["endpoint"] == "both":
-                send_augmented_json(data, packet_id)
-        except Exception as e:
-            print(str(e))
+    elif packet_id == 5 and car_setup != True or packet_id == 6 and car_telemetry != True or packet_id == 7 and car_status != True:
         return
 
-    if packet_id == 4:
-        update_player_info(data)
+    elif packet_id in packet_rows:
+        merged_data = merge_rows(rig, packet, packet_id, header, playerCarIndex)
+        if packet_id == 6:
+            console = (merged_data[0]["engine_rpm"], merged_data[0]["speed"], merged_data[0]["gear"], merged_data[0]["brake"], merged_data[0]["throttle"])
 
-    if packet_id == 5:
-        if car_setup == True:
-            merged_data = merge_car_setups(data, header, playerCarIndex)
-        else:
-            return
+    else:
+        return
 
-    if packet_id == 6:
-        if car_telemetry == True:
-            merged_data = merge_car_telemetry(data, header, playerCarIndex)
-            update_console(merged_data[0]["engine_rpm"], merged_data[0]["speed"], merged_data[0]["gear"], merged_data[0]["brake"], merged_data[0]["throttle"])
-        else:
-            return
+    merged_data = [entry for entry in merged_data if entry["name"] != ""]
 
-    if packet_id == 7:
-        if car_status == True:
-            merged_data = merge_car_status(data, header, playerCarIndex)
-        else:
-            return
+    # Drop samples the emission policy holds back, identifying fields always ride along.
+    # Series are per rig, so rigs sharing the policy (and a decode worker) never
+    # feed each other's deadband, rate or aggregate state.
+    if emission:
+        passthrough = {"car_index", "player_name", "lap_event", "lap_event_count", *header, *rig.player_info[0]}
+        merged_data = [entry for entry in merged_data if emission.filter_record((rig.hostname, packet_id, entry["car_index"]), entry, passthrough) is not None]
+
+    if debug == True:
+        for entry in merged_data:
+            entry.update({"checkpoint_3_payload_processed": time.time()})
 
-    if packet_id == 8:
-        merged_data = merge_final(data, header, playerCarIndex)
+    return packet_id, merged_data, console
 
-    if packet_id == 9:
-        merged_data = merge_lobby(data, header, playerCarIndex)
 
-    if packet_id == 11:
+# Serialise the rows of a packet for HEC and pick their O11y metrics, the CPU
+# heavy half of the egress that runs wherever the packet was transformed
+def prepare_egress(rig, packet_id, merged_data):
+    hec_payload = None
+    o11y_rows = None
 
-        merged_data = merge_session_history(data, header, playerCarIndex)
+    if args["endpoint"] == "core" or args["endpoint"] == "both":
+        if packet_id == 3:
+            hec_payload = hec_json_payload(rig, merged_data[0], packet_id)
+        elif hec_format == "metrics":
+            hec_payload = hec_metrics_payload(rig, merged_data, packet_id)
+        else:
+            hec_payload = hec_batch_payload(rig, merged_data, packet_id)
 
-    merged_data = [entry for entry in merged_data if entry["name"] != ""]
+    if (args["endpoint"] == "o11y" or args["endpoint"] == "both") and packet_id != 3:
+        o11y_rows = select_dims_and_metrics(merged_data)
+
+    return hec_payload, o11y_rows
 
-    if debug == True:
-        for entry in merged_data:
-            entry.update({"checkpoint_3_payload_processed": time.time()})
+
+def ship_packet(rig, hec_payload, o11y_rows, console):
+    if console is not None:
+        update_console(rig, *console)
 
     # send data to HEC
-    if args["endpoint"] == "core" or args["endpoint"] == "both":
-        send_hec_batch(merged_data, packet_id)
+    if hec_payload:
+        hec.send(hec_payload)
 
     # Send data to O11y Cloud
-    if args["endpoint"] == "o11y" or args["endpoint"] == "both":
-        send_dims_and_metrics(merged_data)
+    if o11y_rows:
+        send_dims_and_metrics(rig, o11y_rows)
+
+
+# Packets of a rig are transformed one at a time in arrival order on the
+# rig's decode worker, lap events and emission state depend on the previous
+# packets; serialising and shipping the rows is left to the egress pool
+decode = Executor(
+    "decode",
+    config.getint("telemetry", "decode_threads", fallback=len(rigs)),
+    config.getint("telemetry", "decode_queue_size", fallback=1000),
+    ordered=True,
+)
+egress = Executor("egress", config.getint("ingest", "egress_threads", fallback=2), config.getint("ingest", "egress_queue_size", fallback=1000))
+
+
+# Instrumentation: latency of every stage of a packet, from the datagram
+# being read to the rows being handed to the senders and the senders' HTTP
+# acknowledgement, packets per packet id, drops and egress errors
+registry = Registry("f1_2022_")
+stage_latency = {stage: registry.histogram("stage_seconds", stage=stage) for stage in ("queue", "decode", "transform", "enqueue", "total")}
+packet_counts = [0] * 256
+registry.collect(lambda: [("packets_total", {"packet_id": packet_id}, count, "counter") for packet_id, count in enumerate(packet_counts) if count])
+for sender in (hec, o11y):
+    watch_sender(registry, sender)
+for executor in (decode, egress):
+    watch_executor(registry, executor)
+for rig in rigs:
+    registry.collect(lambda rig=rig: sequence_samples(rig.sequence, rig=rig.hostname))
+
+ring = None
+if args["batch"]:
+    ring = BufferRing(udp_ring_slots)
+    registry.collect(lambda: [("receive_ring_exhausted_total", {}, ring.exhausted, "counter"), ("receive_ring_free", {}, len(ring.free), "gauge")])
+
+
+# Lost, duplicate and out of order packets of every rig, one line per rig
+def describe_sequences():
+    lines = []
+    for rig in rigs:
+        stats = rig.sequence.stats()
+        received = sum(packet["received"] for packet in stats.values())
+        lost = sum(packet["lost"] for packet in stats.values())
+        duplicates = sum(packet["duplicates"] for packet in stats.values())
+        out_of_order = sum(packet["out_of_order"] for packet in stats.values())
+        loss = lost / (received + lost) * 100 if received + lost else 0.0
+        lines.append(f"{rig.hostname}: received {received} lost {lost} ({loss:.2f}%) duplicates {duplicates} out of order {out_of_order}")
+    return "\n".join(lines)
+
+
+def observe_decode(received, started, decoded, transformed):
+    stage_latency["queue"].observe(started - received)
+    stage_latency["decode"].observe(decoded - started)
+    stage_latency["transform"].observe(transformed - decoded)
+
+
+def observe_shipped(received, transformed):
+    shipped = time.perf_counter()
+    stage_latency["enqueue"].observe(shipped - transformed)
+    stage_latency["total"].observe(shipped - received)
+
+
+def massage_data(rig, datagram, received):
+    started = time.perf_counter()
+    packet = unpack_packet(datagram)
+    decoded = time.perf_counter()
+    result = transform_packet(rig, packet)
+    transformed = time.perf_counter()
+    observe_decode(received, started, decoded, transformed)
+    if result is not None:
+        egress.submit(egress_packet, rig, *result, received, transformed)
+
+
+# Decode a batch of datagrams still in their ring slots, every slot is given
+# back once its packet is done with
+def massage_batch(rig, batch, received):
+    for slot, datagram in batch:
+        try:
+            massage_data(rig, datagram, received)
+        except Exception as err:
+            print(f"decode: {err!r}")
+        finally:
+            ring.release(slot)
+
+
+def egress_packet(rig, packet_id, merged_data, console, received, transformed):
+    ship_packet(rig, *prepare_egress(rig, packet_id, merged_data), console)
+    observe_shipped(received, transformed)
+
+
+def report_stats(interval):
+    while True:
+        time.sleep(interval)
+        print(describe_executors([decode, egress]))
+        print(describe_sequences())
+
 
+#########################################
+# Optional process pool decoding, raw datagrams are sharded to worker
+# processes which decode, flatten and serialise them and hand back ready to
+# send HEC payloads and O11y rows.
+def unpack_packet(datagram):
+    header = PacketHeader.from_buffer_copy(datagram)
+    key = (header.packet_format, header.packet_version, header.packet_id)
+    return HEADER_FIELD_TO_PACKET_TYPE[key].unpack(datagram)
+
+
+# Workers ignore Ctrl+C, the main process stops them once their inbox is
+# drained so no worker dies while holding the outbox lock
+def decode_worker(inbox, outbox):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        item = inbox.get()
+        if item is None:
+            return
+        rig_index, player_name, buffer, ends, received = item
+        rig = rigs[rig_index]
+        rig.player_name = player_name
+        view = memoryview(buffer)
+        start = 0
+        for end in ends:
+            datagram = view[start:end]
+            start = end
+            try:
+                started = time.perf_counter()
+                packet = unpack_packet(datagram)
+                decoded = time.perf_counter()
+                result = transform_packet(rig, packet)
+                transformed = time.perf_counter()
+                timings = (received, started, decoded, transformed)
+                if result is None:
+                    outbox.put((rig_index, None, None, None, timings))
+                else:
+                    packet_id, merged_data, console = result
+                    outbox.put((rig_index, *prepare_egress(rig, packet_id, merged_data), console, timings))
+            except Exception as e:
+                print(str(e))
+
+
+# Shipping stays on the egress pool, the console and O11y updates of one
+# result must not hold up the results of the other workers
+def ship_results(outbox):
+    while True:
+        result = outbox.get()
+        if result is None:
+            return
+        rig_index, hec_payload, o11y_rows, console, timings = result
+        observe_decode(*timings)
+        if hec_payload or o11y_rows or console:
+            egress.submit(ship_result, rigs[rig_index], hec_payload, o11y_rows, console, timings[0], timings[3])
+
+
+def ship_result(rig, hec_payload, o11y_rows, console, received, transformed):
+    ship_packet(rig, hec_payload, o11y_rows, console)
+    observe_shipped(received, transformed)
+
+
+class DecodePool:
+    def __init__(self, workers):
+        context = multiprocessing.get_context("fork")
+        self.inboxes = [context.SimpleQueue() for i in range(workers)]
+        self.outbox = context.SimpleQueue()
+        self.processes = [context.Process(target=decode_worker, args=(inbox, self.outbox), daemon=True) for inbox in self.inboxes]
+        self.next = 0
+        for process in self.processes:
+            process.start()
+        self.shipper = threading.Thread(target=ship_results, name="ship_results", args=(self.outbox,), daemon=True)
+        self.shipper.start()
+
+    # Participants go to every worker. Lap data, and every packet type when an
+    # emission policy is active, carries state across packets so it is pinned
+    # to one worker per rig and packet type; everything else is round-robin.
+    def shards(self, rig_index, packet_id):
+        if packet_id == 4:
+            return range(len(self.inboxes))
+        if packet_id == 2 or emission:
+            return ((rig_index * 16 + packet_id) % len(self.inboxes),)
+        self.next = (self.next + 1) % len(self.inboxes)
+        return (self.next,)
+
+    def submit(self, rig_index, datagram, received):
+        item = (rig_index, rigs[rig_index].player_name, datagram, (len(datagram),), received)
+        for shard in self.shards(rig_index, datagram[PACKET_ID_OFFSET]):
+            self.inboxes[shard].put(item)
+
+    # A batch of ring slots is copied once into one buffer per worker, with
+    # the end offset of every datagram, and handed over as a single item
+    def submit_batch(self, rig_index, batch, received):
+        parts = [[] for inbox in self.inboxes]
+        for slot, datagram in batch:
+            for shard in self.shards(rig_index, datagram[PACKET_ID_OFFSET]):
+                parts[shard].append(datagram)
+        player_name = rigs[rig_index].player_name
+        for shard, datagrams in enumerate(parts):
+            if datagrams:
+                ends = list(itertools.accumulate(len(datagram) for datagram in datagrams))
+                self.inboxes[shard].put((rig_index, player_name, b"".join(datagrams), ends, received))
+
+    # Let the workers finish what they were handed, then ship their results
+    def stop(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+        self.outbox.put(None)
+        self.shipper.join()
+
+
+# Fork the decode workers before any sender thread is started
+decode_pool = None
+if args["workers"]:
+    if "fork" not in multiprocessing.get_all_start_methods():
+        parser.error("--workers needs the fork start method, which this platform does not support")
+    decode_pool = DecodePool(args["workers"])
+
+decode.start()
+egress.start()
+
+player_registry = PlayerRegistry(database, player_flush_interval, update_player_names).start()
 
 # Initialise session
 startup_payload = [{"message": "F1 2022 script starting", "description": "Initialising Script", "splunk_hec_ip": splunk_hec_ip, "checkpoint_1": datetime.now().timestamp()}]
 
 if args["endpoint"] == "core" or args["endpoint"] == "both":
-    send_hec_batch(startup_payload, 99)
+    for rig in rigs:
+        hec.send(hec_batch_payload(rig, startup_payload, 99))
+
+# Hand a datagram read on its own to the decoders
+def receive_one(rig_index, listener):
+    datagram = listener.socket.recv(2048)
+    received = time.perf_counter()
+    packet_counts[datagram[PACKET_ID_OFFSET]] += 1
+    rigs[rig_index].sequence.track(datagram)
+    if decode_pool is not None:
+        decode_pool.submit(rig_index, datagram, received)
+    else:
+        decode.submit(massage_data, rigs[rig_index], datagram, received, key=rig_index)
 
-listener = TelemetryListener(port=udp_port)
 
-with Live(layout, refresh_per_second=4) as live:
+# Drain the socket into the ring and hand the batch to the decoders as one task
+def receive_batch(rig_index, receiver):
+    batch = receiver.receive()
+    if not batch:
+        if not ring.free:
+            # Ring exhausted, the datagrams wait in the kernel until slots are free
+            time.sleep(0.001)
+        return
+    received = time.perf_counter()
+    rig = rigs[rig_index]
+    for slot, datagram in batch:
+        packet_counts[datagram[PACKET_ID_OFFSET]] += 1
+        rig.sequence.track(datagram)
+    if decode_pool is not None:
+        decode_pool.submit_batch(rig_index, batch, received)
+        ring.release_all(batch)
+    elif not decode.submit(massage_batch, rig, batch, received, key=rig_index):
+        ring.release_all(batch)
+
+
+# One selector demultiplexes the UDP ports of every rig
+selector = selectors.DefaultSelector()
+for rig_index, rig in enumerate(rigs):
+    listener = TelemetryListener(host=args["bind"], port=rig.udp_port)
+    if udp_rcvbuf:
+        granted = set_receive_buffer(listener.socket, udp_rcvbuf)
+        if granted < udp_rcvbuf:
+            print(f"{rig.hostname}: asked for a {udp_rcvbuf} byte receive buffer, got {granted}, raise net.core.rmem_max")
+    if ring is not None:
+        selector.register(listener.socket, selectors.EVENT_READ, (rig_index, receive_batch, BatchReceiver(listener.socket, ring, args["batch"])))
+    else:
+        selector.register(listener.socket, selectors.EVENT_READ, (rig_index, receive_one, listener))
+
+started = time.monotonic()
+if stats_interval:
+    threading.Thread(target=report_stats, name="report_stats", args=(stats_interval,), daemon=True).start()
+if metrics_port:
+    serve_metrics(registry, metrics_port, metrics_bind)
+self_metrics = SelfMetrics(registry, ingest, self_metrics_interval, {"host": socket.gethostname()})
+if self_metrics_interval:
+    self_metrics.start()
+
+with console:
     try:
         while True:
-            packet = listener.get()
-            massage_data(packet)
+            for key, events in selector.select():
+                rig_index, receive, source = key.data
+                receive(rig_index, source)
     except KeyboardInterrupt:
+        if decode_pool is not None:
+            decode_pool.stop()
+        decode.stop()
+        egress.stop()
+        print(describe_executors([decode, egress]))
+        print(describe_sequences())
+        hec.stop()
+        o11y.stop()
+        self_metrics.stop()
+        ingest.stop()
+        if args["endpoint"] == "core" or args["endpoint"] == "both":
+            print(f"HEC {describe_wire(hec.stats(), {}, time.monotonic() - started)}")
+        player_registry.stop()
         conn = sqlite3.connect(database, check_same_thread=False)
-        conn.execute("UPDATE players SET listener_pid = ? WHERE hostname = ?", (0, hostname))
+        for rig in rigs:
+            conn.execute("UPDATE players SET listener_pid = ? WHERE hostname = ?", (0, rig.hostname))
         conn.commit()
         conn.close()
         pass
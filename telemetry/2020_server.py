@@ -2,6 +2,7 @@ import socket
 import yaml
 import telemetry.splunk as metrics
 from f1_2020_telemetry.packets import unpack_udp_packet
+from telemetry.receiver import BufferRing, BatchReceiver
 from socket import gethostname, getfqdn, gethostbyname
 
 with open("config.yaml", "r") as ymlfile:
@@ -16,42 +17,51 @@ def start_driver(driver_name):
     print(f"Listening to Port {cfg['UDP_PORT']} on {udp_socket.getsockname()[0]} ...")
     lastLap = 0  # force a new lap after we pass start finish
     sector3TimeInS = 0
+    # UDP_BATCH drains the socket into a ring of preallocated buffers, the
+    # packets are processed right away so a ring of one batch is enough
+    receiver = BatchReceiver(udp_socket, BufferRing(cfg["UDP_BATCH"]), cfg["UDP_BATCH"]) if cfg.get("UDP_BATCH") else None
     # Receive Packages
     while True:
-        udp_packet = udp_socket.recv(2048)
-        packet = unpack_udp_packet(udp_packet)
+        if receiver is None:
+            datagrams = [(None, udp_socket.recv(2048))]
+        else:
+            datagrams = receiver.receive(wait=True)
+        for slot, udp_packet in datagrams:
+            packet = unpack_udp_packet(udp_packet)
 
-        packet_type = packet.header.packetId  # get the packet type from the header
-        position = (
-            packet.header.playerCarIndex
-        )  # get the position of the driver in the list as the packet contains data of all driving cars
+            packet_type = packet.header.packetId  # get the packet type from the header
+            position = (
+                packet.header.playerCarIndex
+            )  # get the position of the driver in the list as the packet contains data of all driving cars
 
-        # LAP DATA
-        if packet_type == 2:
-            newLap = False
-            car_laptime_data = packet.lapData[position]
-            if car_laptime_data.currentLapNum > lastLap:
-                newLap = True
-                lastLap = car_laptime_data.currentLapNum
-                sector3TimeInS = car_laptime_data.lastLapTime - (
-                    car_laptime_data.sector1TimeInMS + car_laptime_data.sector1TimeInMS
+            # LAP DATA
+            if packet_type == 2:
+                newLap = False
+                car_laptime_data = packet.lapData[position]
+                if car_laptime_data.currentLapNum > lastLap:
+                    newLap = True
+                    lastLap = car_laptime_data.currentLapNum
+                    sector3TimeInS = car_laptime_data.lastLapTime - (
+                        car_laptime_data.sector1TimeInMS + car_laptime_data.sector1TimeInMS
+                    )
+                    print(f"Starting Lap {lastLap}...")
+                elif (
+                    car_laptime_data.sector1TimeInMS == 0
+                    and car_laptime_data.sector1TimeInMS == 0
+                ):
+                    sector3TimeInS = 0
+                metrics.write_lap_data_to_splunk(
+                    driver_name, car_laptime_data, sector3TimeInS
                 )
-                print(f"Starting Lap {lastLap}...")
-            elif (
-                car_laptime_data.sector1TimeInMS == 0
-                and car_laptime_data.sector1TimeInMS == 0
-            ):
-                sector3TimeInS = 0
-            metrics.write_lap_data_to_splunk(
-                driver_name, car_laptime_data, sector3TimeInS
-            )
 
-        # TELEMETRY DATA
-        if packet_type == 6:
-            car_telemetry_data = packet.carTelemetryData[position]
-            metrics.write_telemetry_data_to_splunk(driver_name, car_telemetry_data)
+            # TELEMETRY DATA
+            if packet_type == 6:
+                car_telemetry_data = packet.carTelemetryData[position]
+                metrics.write_telemetry_data_to_splunk(driver_name, car_telemetry_data)
 
-        # CAR STATUS DATA
-        if packet_type == 7:
-            car_status_data = packet.carStatusData[position]
-            metrics.write_car_status_data_to_splunk(driver_name, car_status_data)
+            # CAR STATUS DATA
+            if packet_type == 7:
+                car_status_data = packet.carStatusData[position]
+                metrics.write_car_status_data_to_splunk(driver_name, car_status_data)
+        if receiver is not None:
+            receiver.ring.release_all(datagrams)
@@ -2,6 +2,7 @@ import signalfx
 import logging
 import yaml
 import sys
+from telemetry.schema import MetricSchema, wheels
 
 with open("config.yaml", "r") as ymlfile:
     cfg = yaml.safe_load(ymlfile)
@@ -15,167 +16,69 @@ sfx = signalfx.SignalFx(
 ingest = sfx.ingest(cfg["ACCESS_TOKEN"])
 
 
+telemetry_schema = MetricSchema(
+    "f1_2021.",
+    [
+        ("speed", "speed"),
+        ("engineRPM", "engineRPM"),
+        ("gear", "gear"),
+        ("brake", "brake"),
+        *wheels("brakeTemp", "brakesTemperature"),
+        *wheels("tyresSurfaceTemp", "tyresSurfaceTemperature"),
+    ],
+)
+
+car_status_schema = MetricSchema("f1_2021.", [("tyreWearFL", "tyresWear", 0)])
+
+lap_data_schema = MetricSchema(
+    "f1_2021.",
+    [
+        ("currentLapNum", "currentLapNum"),
+        ("lastLapTime", "lastLapTime"),
+        ("currentLapTime", "currentLapTime"),
+        ("bestLapTime", "bestLapTime"),
+        ("bestLapNum", "bestLapNum"),
+        ("sector1TimeInMS", "sector1TimeInMS"),
+        ("sector2TimeInMS", "sector2TimeInMS"),
+        ("bestOverallSector1TimeInMS", "bestOverallSector1TimeInMS"),
+        ("bestOverallSector1LapNum", "bestOverallSector2LapNum"),
+        ("bestOverallSector2TimeInMS", "bestOverallSector2TimeInMS"),
+        ("bestOverallSector2LapNum", "bestOverallSector2LapNum"),
+        ("bestOverallSector3TimeInMS", "bestOverallSector3TimeInMS"),
+        ("bestOverallSector3LapNum", "bestOverallSector2LapNum"),
+    ],
+)
+
+driver_dimensions = {}
+
+
+def get_dimensions(driver_name):
+    if driver_name not in driver_dimensions:
+        driver_dimensions[driver_name] = {"driver": driver_name}
+    return driver_dimensions[driver_name]
+
+
 def write_telemetry_data_to_splunk(driver_name, car_telemetry_data):
     # logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-    ingest.send(
-        gauges=[
-            {
-                "metric": "f1_2021.speed",
-                "value": car_telemetry_data.speed,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.engineRPM",
-                "value": car_telemetry_data.engineRPM,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.gear",
-                "value": car_telemetry_data.gear,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.brake",
-                "value": car_telemetry_data.brake,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.brakeTempFL",
-                "value": car_telemetry_data.brakesTemperature[0],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.brakeTempFR",
-                "value": car_telemetry_data.brakesTemperature[1],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.brakeTempRL",
-                "value": car_telemetry_data.brakesTemperature[2],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.brakeTempRR",
-                "value": car_telemetry_data.brakesTemperature[3],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.tyresSurfaceTempFL",
-                "value": car_telemetry_data.tyresSurfaceTemperature[0],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.tyresSurfaceTempFR",
-                "value": car_telemetry_data.tyresSurfaceTemperature[1],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.tyresSurfaceTempRL",
-                "value": car_telemetry_data.tyresSurfaceTemperature[2],
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.tyresSurfaceTempRR",
-                "value": car_telemetry_data.tyresSurfaceTemperature[3],
-                "dimensions": {"driver": driver_name},
-            },
-        ]
-    )
+    dimensions = get_dimensions(driver_name)
+    ingest.send(gauges=telemetry_schema.gauges(telemetry_schema.read(car_telemetry_data), dimensions))
 
     if car_telemetry_data.drs == 1:
         ingest.send_event(
             event_type="drs_enabled",
             category="USER_DEFINED",
-            dimensions={"driver": driver_name},
+            dimensions=dimensions,
         )
 
 
 def write_car_status_data_to_splunk(driver_name, car_status_data):
     # logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-    ingest.send(
-        gauges=[
-            {
-                "metric": "f1_2021.tyreWearFL",
-                "value": car_status_data.tyresWear[0],
-                "dimensions": {"driver": driver_name},
-            },
-        ]
-    )
+    ingest.send(gauges=car_status_schema.gauges(car_status_schema.read(car_status_data), get_dimensions(driver_name)))
 
 
 def write_lap_data_to_splunk(driver_name, car_laptime_data, sector3TimeInS):
     # logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-    ingest.send(
-        gauges=[
-            {
-                "metric": "f1_2021.currentLapNum",
-                "value": car_laptime_data.currentLapNum,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.lastLapTime",
-                "value": car_laptime_data.lastLapTime,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.currentLapTime",
-                "value": car_laptime_data.currentLapTime,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestLapTime",
-                "value": car_laptime_data.bestLapTime,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestLapNum",
-                "value": car_laptime_data.bestLapNum,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.sector1TimeInMS",
-                "value": car_laptime_data.sector1TimeInMS,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.sector2TimeInMS",
-                "value": car_laptime_data.sector2TimeInMS,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector1TimeInMS",
-                "value": car_laptime_data.bestOverallSector1TimeInMS,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector1LapNum",
-                "value": car_laptime_data.bestOverallSector2LapNum,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector2TimeInMS",
-                "value": car_laptime_data.bestOverallSector2TimeInMS,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector2LapNum",
-                "value": car_laptime_data.bestOverallSector2LapNum,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector3TimeInMS",
-                "value": car_laptime_data.bestOverallSector3TimeInMS,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.bestOverallSector3LapNum",
-                "value": car_laptime_data.bestOverallSector2LapNum,
-                "dimensions": {"driver": driver_name},
-            },
-            {
-                "metric": "f1_2021.sector3TimeInS",
-                "value": sector3TimeInS,
-                "dimensions": {"driver": driver_name},
-            },
-        ]
-    )
+    dimensions = get_dimensions(driver_name)
+    gauges = lap_data_schema.gauges(lap_data_schema.read(car_laptime_data), dimensions)
+    gauges.append({"metric": "f1_2021.sector3TimeInS", "value": sector3TimeInS, "dimensions": dimensions})
+    ingest.send(gauges=gauges)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Raw UDP capture and replay, so the listeners can be load-tested without a
+# console running a race.
+#
+#   python -m telemetry.capture record --port 20777 --output race.f1cap
+#   python -m telemetry.capture replay --input race.f1cap --port 20777 --speed 4
+#
+# A capture file is a magic header followed by one record per datagram: the
+# receive timestamp as a little-endian double, the payload length as an
+# unsigned short and the raw payload.
+import argparse
+import socket
+import struct
+import time
+
+MAGIC = b"F1UDPCAP\x01"
+RECORD = struct.Struct("<dH")
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.packets = 0
+
+    def write(self, datagram, timestamp):
+        self.file.write(RECORD.pack(timestamp, len(datagram)))
+        self.file.write(datagram)
+        self.packets += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Yields (timestamp, datagram) for every record of a capture file
+def read_capture(path):
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a UDP capture file")
+        while True:
+            record = capture.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            timestamp, length = RECORD.unpack(record)
+            yield timestamp, capture.read(length)
+
+
+def record(port, path, host=""):
+    udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    udp_socket.bind((host, port))
+    print(f"Capturing UDP port {port} to {path}, Ctrl+C to stop ...")
+    with CaptureWriter(path) as writer:
+        try:
+            while True:
+                datagram = udp_socket.recv(2048)
+                writer.write(datagram, time.time())
+        except KeyboardInterrupt:
+            pass
+    udp_socket.close()
+    print(f"Captured {writer.packets} packets")
+    return writer.packets
+
+
+# Send a capture to host:port. speed 1 replays in real time, N replays N times
+# faster and 0 sends as fast as possible. Returns the packets/sec achieved.
+def replay(path, host="127.0.0.1", port=20777, speed=1.0, loops=1):
+    packets = list(read_capture(path))
+    if not packets:
+        return 0.0
+
+    udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    first = packets[0][0]
+    sent = 0
+    start = time.perf_counter()
+    for loop in range(loops):
+        loop_start = time.perf_counter()
+        for timestamp, datagram in packets:
+            if speed:
+                delay = loop_start + (timestamp - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            udp_socket.sendto(datagram, (host, port))
+            sent += 1
+    elapsed = time.perf_counter() - start
+    udp_socket.close()
+    return sent / elapsed if elapsed else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture and replay raw F1 UDP telemetry")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Write received datagrams to a capture file")
+    record_parser.add_argument("-p", "--port", type=int, default=20777, help="UDP port to listen on")
+    record_parser.add_argument("-o", "--output", required=True, help="Capture file to write")
+
+    replay_parser = commands.add_parser("replay", help="Send a capture file to a listener")
+    replay_parser.add_argument("-i", "--input", required=True, help="Capture file to read")
+    replay_parser.add_argument("--host", default="127.0.0.1", help="Listener host")
+    replay_parser.add_argument("-p", "--port", type=int, default=20777, help="Listener UDP port")
+    replay_parser.add_argument("-s", "--speed", type=float, default=1.0, help="1 for real time, N for N times faster, 0 for as fast as possible")
+    replay_parser.add_argument("-l", "--loops", type=int, default=1, help="Number of times to replay the capture")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.port, args.output)
+    else:
+        rate = replay(args.input, args.host, args.port, args.speed, args.loops)
+        print(f"Replayed at {rate:.0f} packets/sec")
+
+
+if __name__ == "__main__":
+    main()
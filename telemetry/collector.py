@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Local stand-in for Splunk HEC and the SignalFx ingest API, so every egress
+# path can be benchmarked offline.
+#
+#   python -m telemetry.collector --port 8088 --latency 0.02 --error-rate 0.01 --throttle 200
+#
+# Accepts /services/collector (HEC) and /v2/datapoint, /v2/event (SignalFx)
+# with configurable latency, error rate and throttling, and records requests,
+# events, bytes and a request latency histogram. GET /stats returns them as JSON.
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from signalfx.generated_protocol_buffers import signal_fx_protocol_buffers_pb2 as sf_pbuf  # type: ignore
+except ImportError:
+    sf_pbuf = None
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+# Counts the events of a HEC body, events are concatenated JSON objects
+def count_hec_events(body):
+    decoder = json.JSONDecoder()
+    text = body.decode()
+    position = 0
+    events = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            return events
+        _, position = decoder.raw_decode(text, position)
+        events += 1
+
+
+def count_datapoints(body, content_type):
+    if "json" in content_type:
+        return sum(len(datapoints) for datapoints in json.loads(body).values())
+    if sf_pbuf is not None:
+        message = sf_pbuf.DataPointUploadMessage()
+        message.ParseFromString(body)
+        return len(message.datapoints)
+    return 0
+
+
+def count_sfx_events(body, content_type):
+    if "json" in content_type:
+        return len(json.loads(body))
+    if sf_pbuf is not None:
+        message = sf_pbuf.EventUploadMessage()
+        message.ParseFromString(body)
+        return len(message.events)
+    return 0
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.reply(200, self.server.stats())
+        else:
+            self.reply(404, {"text": "Not found"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0].rstrip("/")
+
+        if path.startswith("/services/collector"):
+            kind = "hec"
+        elif path == "/v2/datapoint":
+            kind = "datapoint"
+        elif path == "/v2/event":
+            kind = "event"
+        else:
+            self.reply(404, {"text": "Not found"})
+            return
+
+        status, response = self.server.ingest(kind, body, self.headers)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.reply(status, response)
+        self.server.record_latency(time.perf_counter() - start)
+
+
+class FakeCollector(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8088), latency=0.0, error_rate=0.0, throttle=0):
+        super().__init__(address, CollectorHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.lock = threading.Lock()
+        self.window = (0, 0)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {
+                kind: {"requests": 0, "events": 0, "bytes": 0, "errors": 0, "throttled": 0}
+                for kind in ("hec", "datapoint", "event")
+            }
+            self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    # Requests beyond the throttle in the current second are rejected
+    def throttled(self):
+        if not self.throttle:
+            return False
+        second = int(time.time())
+        with self.lock:
+            current, requests = self.window
+            if current != second:
+                current, requests = second, 0
+            self.window = (current, requests + 1)
+        return requests >= self.throttle
+
+    def ingest(self, kind, body, headers):
+        counters = self.counters[kind]
+        with self.lock:
+            counters["requests"] += 1
+            counters["bytes"] += len(body)
+
+        if self.throttled():
+            with self.lock:
+                counters["throttled"] += 1
+            return (503, {"text": "Server is busy", "code": 9}) if kind == "hec" else (429, {"text": "Too many requests"})
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                counters["errors"] += 1
+            return 500, {"text": "Internal server error", "code": 8}
+
+        if headers.get("Content-Encoding", "") == "gzip":
+            body = gzip.decompress(body)
+        content_type = headers.get("Content-Type", "")
+        try:
+            if kind == "hec":
+                events = count_hec_events(body)
+            elif kind == "datapoint":
+                events = count_datapoints(body, content_type)
+            else:
+                events = count_sfx_events(body, content_type)
+        except ValueError:
+            with self.lock:
+                counters["errors"] += 1
+            return 400, {"text": "Invalid data format", "code": 6}
+
+        with self.lock:
+            counters["events"] += events
+        return (200, {"text": "Success", "code": 0}) if kind == "hec" else (200, "OK")
+
+    def record_latency(self, seconds):
+        milliseconds = seconds * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS))
+        with self.lock:
+            self.histogram[bucket] += 1
+
+    def stats(self):
+        with self.lock:
+            labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+            return {
+                "elapsed": time.time() - self.started,
+                "counters": {kind: dict(counters) for kind, counters in self.counters.items()},
+                "latency": dict(zip(labels, self.histogram)),
+            }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake_collector", daemon=True).start()
+        return self
+
+
+def print_stats(stats):
+    elapsed = max(stats["elapsed"], 1e-9)
+    for kind, counters in stats["counters"].items():
+        if counters["requests"]:
+            print(
+                f"{kind:<9} requests: {counters['requests']} events: {counters['events']} ({counters['events'] / elapsed:.0f}/s) "
+                + f"bytes: {counters['bytes']} ({counters['bytes'] / elapsed:.0f}/s) errors: {counters['errors']} throttled: {counters['throttled']}"
+            )
+    print("latency   " + " ".join(f"{label}: {count}" for label, count in stats["latency"].items() if count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Splunk HEC and SignalFx ingest stand-in")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("-p", "--port", type=int, default=8088, help="Port to bind")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--throttle", type=int, default=0, help="Requests per second accepted before answering 503/429, 0 for no limit")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between stats reports")
+    args = parser.parse_args()
+
+    collector = FakeCollector((args.host, args.port), args.latency, args.error_rate, args.throttle).start()
+    print(f"Fake collector listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(args.interval)
+            print_stats(collector.stats())
+    except KeyboardInterrupt:
+        print_stats(collector.stats())
+        collector.shutdown()
+
+
+if __name__ == "__main__":
+    main()
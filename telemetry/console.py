@@ -0,0 +1,42 @@
+from rich.live import Live  # type: ignore
+
+
+# Console of the listeners, decoupled from packet processing. Packet handlers
+# only store the latest value of a panel with update(), a dict assignment;
+# the panels are rebuilt from those values by rich's own refresh thread, once
+# per refresh and only when their value changed. Headless it never starts
+# rich at all.
+class Console:
+    def __init__(self, layout, refresh_per_second=4, headless=False):
+        self.layout = layout
+        self.refresh_per_second = refresh_per_second
+        self.headless = headless
+        self.renderers = {}
+        self.latest = {}
+        self.rendered = {}
+        self.live = None
+
+    # render(value) rebuilds the panels for the values stored under key
+    def renderer(self, key, render):
+        self.renderers[key] = render
+
+    def update(self, key, value):
+        self.latest[key] = value
+
+    def renderable(self):
+        for key, value in list(self.latest.items()):
+            if self.rendered.get(key, self) is not value:
+                self.rendered[key] = value
+                self.renderers[key](value)
+        return self.layout
+
+    def __enter__(self):
+        if not self.headless:
+            self.live = Live(get_renderable=self.renderable, refresh_per_second=self.refresh_per_second)
+            self.live.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self.live is not None:
+            self.live.__exit__(*exc)
+            self.live = None
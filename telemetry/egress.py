@@ -0,0 +1,300 @@
+import gzip
+import json
+import queue
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from telemetry.instrument import Histogram
+
+_LINGER_EXPIRED = object()
+
+# Base class for the long-lived senders. Producers hand items over with a
+# non-blocking put on a bounded queue (dropping and counting when it is full)
+# and a single worker thread drains it, shipping whatever has accumulated once
+# max_events items or max_bytes (as measured by size()) are waiting, or
+# max_linger seconds have passed. A batch never goes over max_bytes: an item
+# that would push it over is left for the next batch, only an item larger
+# than max_bytes on its own is sent alone. latency records the time from put() to the
+# delivery of the oldest event of each batch.
+class BatchSender:
+    name = "sender"
+
+    def __init__(self, max_queue=10000, max_events=500, max_linger=1.0, max_bytes=0):
+        self.max_events = max_events
+        self.max_linger = max_linger
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.counters = {"queued": 0, "dropped": 0, "sent": 0, "failed": 0, "batches": 0}
+        self.latency = Histogram()
+        self.thread = None
+        self.running = False
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def put(self, item):
+        if not self.running:
+            self.start()
+        try:
+            self.queue.put_nowait((time.perf_counter(), item))
+        except queue.Full:
+            self.count("dropped")
+            return False
+        self.count("queued")
+        return True
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    # Flush what is still queued and stop the worker thread
+    def stop(self, timeout=5):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        batch = []
+        batch_bytes = 0
+        deadline = None
+        oldest = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _LINGER_EXPIRED
+
+            if item is not None and item is not _LINGER_EXPIRED:
+                queued_at, item = item
+                item = self.prepare(item)
+                size = self.size(item) if self.max_bytes else 0
+                if batch and self.max_bytes and batch_bytes + size > self.max_bytes:
+                    self.flush(batch, oldest)
+                    batch = []
+                    batch_bytes = 0
+                if not batch:
+                    deadline = time.monotonic() + self.max_linger
+                    oldest = queued_at
+                batch.append(item)
+                batch_bytes += size
+                if len(batch) < self.max_events and not (self.max_bytes and batch_bytes >= self.max_bytes):
+                    continue
+
+            if batch:
+                self.flush(batch, oldest)
+                batch = []
+                batch_bytes = 0
+                deadline = None
+
+            if item is None:
+                return
+
+    def flush(self, batch, oldest):
+        try:
+            counter = self.ship(batch) or "sent"
+        except Exception as err:
+            self.count("failed", len(batch))
+            print(f"{self.name}: {err}")
+        else:
+            self.count(counter, len(batch))
+            if counter == "sent":
+                self.latency.observe(time.perf_counter() - oldest)
+        self.count("batches")
+
+    # Turn a queued item into what is batched, on the worker thread
+    def prepare(self, item):
+        return item
+
+    def size(self, item):
+        return 0
+
+    # Deliver a batch; may return the counter the events count towards
+    # instead of "sent"
+    def ship(self, batch):
+        raise NotImplementedError
+
+
+# Connection errors, timeouts, throttling and server errors are worth
+# retrying, anything else the collector refused will be refused again
+def retryable(err):
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and (err.response.status_code >= 500 or err.response.status_code == 429)
+    return isinstance(err, (requests.ConnectionError, requests.Timeout))
+
+
+# Sends events to Splunk HEC, many events per POST as newline-delimited JSON
+# over a pooled keep-alive session. Events are either dicts or already
+# serialised bytes. A gzip_level above 0 sends the bodies gzip compressed
+# (Content-Encoding: gzip); raw_bytes and wire_bytes count what was posted
+# before and after compression.
+#
+# With a Spool, batches that could not be delivered go to disk instead of
+# being dropped. After the first failure live batches are spooled straight
+# away, without waiting for a timeout each, and a drain thread with its own
+# session replays the spool oldest first at up to drain_rate requests per
+# second, backing off while the collector is still unreachable. Once a
+# replay succeeds live batches are posted again.
+class HecSender(BatchSender):
+    name = "splunk_hec"
+
+    def __init__(self, url, token, verify=True, timeout=10, spool=None, drain_rate=5.0, gzip_level=0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.token = token
+        self.verify = verify
+        self.timeout = timeout
+        self.gzip_level = gzip_level
+        self.session = self.new_session()
+        self.spool = spool
+        self.drain_rate = drain_rate
+        self.online = threading.Event()
+        self.online.set()
+        self.drained = threading.Event()
+        self.drainer = None
+        self.counters.update({"spooled": 0, "raw_bytes": 0, "wire_bytes": 0})
+
+    def new_session(self):
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        session.headers.update({"Authorization": "Splunk " + self.token})
+        if self.gzip_level:
+            session.headers.update({"Content-Encoding": "gzip"})
+        session.verify = self.verify
+        return session
+
+    def send(self, event):
+        return self.put(event)
+
+    def prepare(self, event):
+        return event if isinstance(event, bytes) else json.dumps(event, separators=(",", ":")).encode()
+
+    def size(self, event):
+        return len(event) + 1
+
+    # Payloads are spooled uncompressed and compressed on every post
+    def post(self, session, payload):
+        body = gzip.compress(payload, self.gzip_level) if self.gzip_level else payload
+        response = session.post(self.url, data=body, timeout=self.timeout)
+        response.raise_for_status()
+        with self.lock:
+            self.counters["raw_bytes"] += len(payload)
+            self.counters["wire_bytes"] += len(body)
+
+    def ship(self, batch):
+        payload = b"\n".join(batch)
+        if self.spool is None:
+            self.post(self.session, payload)
+            return
+        if self.online.is_set():
+            try:
+                self.post(self.session, payload)
+                return
+            except Exception as err:
+                if not retryable(err):
+                    raise
+                print(f"{self.name}: {err}, spooling to disk")
+                self.online.clear()
+        self.spool.append(payload)
+        return "spooled"
+
+    def start(self):
+        super().start()
+        if self.spool is not None and self.drainer is None:
+            self.drainer = threading.Thread(target=self.drain, name=self.name + "_drain", daemon=True)
+            self.drainer.start()
+
+    def drain(self):
+        session = self.new_session()
+        backoff = 1.0
+        while not self.drained.is_set():
+            payload = self.spool.peek()
+            if payload is None:
+                self.online.set()
+                self.drained.wait(1.0)
+                continue
+            try:
+                self.post(session, payload)
+            except Exception as err:
+                if retryable(err):
+                    self.online.clear()
+                    self.drained.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                print(f"{self.name}: dropping spooled batch, {err}")
+            self.spool.ack(payload)
+            self.online.set()
+            backoff = 1.0
+            self.drained.wait(1.0 / self.drain_rate)
+
+    def stop(self, timeout=5):
+        super().stop(timeout)
+        if self.drainer is not None:
+            self.drained.set()
+            self.drainer.join(timeout)
+            self.spool.close()
+
+    def stats(self):
+        stats = super().stats()
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        return stats
+
+
+# One line on the HEC bytes posted between two stats() snapshots
+def describe_wire(stats, previous, elapsed):
+    raw = stats["raw_bytes"] - previous.get("raw_bytes", 0)
+    wire = stats["wire_bytes"] - previous.get("wire_bytes", 0)
+    ratio = raw / wire if wire else 1.0
+    return f"wire {wire / max(elapsed, 1e-9) / 1024:.1f} KiB/s (raw {raw / max(elapsed, 1e-9) / 1024:.1f} KiB/s, compression {ratio:.1f}x)"
+
+
+# Hands gauges and events to the SignalFx ingest client from a worker thread,
+# merging the gauges of every queued packet into a single ingest.send call.
+class GaugeSender(BatchSender):
+    name = "splunk_o11y"
+
+    def __init__(self, ingest, **kwargs):
+        super().__init__(**kwargs)
+        self.ingest = ingest
+
+    def send(self, gauges):
+        return self.put(("gauges", gauges))
+
+    # Parallel metric names and values, expanded into gauges on this thread
+    def send_values(self, metrics, values, dimensions):
+        return self.put(("values", (metrics, values, dimensions)))
+
+    def send_event(self, **event):
+        return self.put(("event", event))
+
+    def ship(self, batch):
+        gauges = []
+        for kind, item in batch:
+            if kind == "gauges":
+                gauges.extend(item)
+            elif kind == "values":
+                metrics, values, dimensions = item
+                gauges.extend({"metric": metric, "value": value, "dimensions": dimensions} for metric, value in zip(metrics, values))
+        if gauges:
+            self.ingest.send(gauges=gauges)
+        for kind, item in batch:
+            if kind == "event":
+                self.ingest.send_event(**item)
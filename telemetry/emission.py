@@ -0,0 +1,156 @@
+import fnmatch
+import time
+
+AGGREGATE_SUFFIXES = ("_min", "_max", "_avg")
+
+
+# Emit every sample, the default for metrics without a rule
+class EveryRule:
+    def new_state(self):
+        return None
+
+    def emit(self, state, name, value, now):
+        return ((name, value),)
+
+
+# Fixed-rate downsampling: at most hz samples per second
+class RateRule:
+    def __init__(self, hz):
+        self.period = 1.0 / float(hz)
+
+    def new_state(self):
+        return [0.0]
+
+    def emit(self, state, name, value, now):
+        if now < state[0]:
+            return ()
+        state[0] = now + self.period
+        return ((name, value),)
+
+
+# Deadband: only emit once the value moved more than threshold since the
+# last emitted sample
+class DeadbandRule:
+    def __init__(self, threshold):
+        self.threshold = float(threshold)
+
+    def new_state(self):
+        return [None]
+
+    def emit(self, state, name, value, now):
+        if state[0] is not None and abs(value - state[0]) <= self.threshold:
+            return ()
+        state[0] = value
+        return ((name, value),)
+
+
+# Aggregate over a window of seconds, emitting name_min, name_max and name_avg
+# when the first sample after the window arrives
+class AggregateRule:
+    def __init__(self, window):
+        self.window = float(window)
+
+    def new_state(self):
+        # window end, count, total, min, max
+        return [None, 0, 0.0, None, None]
+
+    def emit(self, state, name, value, now):
+        emitted = ()
+        if state[0] is None:
+            state[0] = now + self.window
+        elif now >= state[0]:
+            if state[1]:
+                emitted = ((name + "_min", state[3]), (name + "_max", state[4]), (name + "_avg", state[2] / state[1]))
+            state[:] = [now + self.window, 0, 0.0, None, None]
+
+        state[1] += 1
+        state[2] += value
+        state[3] = value if state[3] is None else min(state[3], value)
+        state[4] = value if state[4] is None else max(state[4], value)
+        return emitted
+
+
+RULES = {"all": EveryRule, "rate": RateRule, "deadband": DeadbandRule, "aggregate": AggregateRule}
+
+
+# Parse "all", "rate:<hz>", "deadband:<threshold>" or "aggregate:<seconds>"
+def parse_rule(spec):
+    kind, _, argument = str(spec).strip().partition(":")
+    if kind not in RULES:
+        raise ValueError(f"Unknown emission policy '{spec}', expected one of {', '.join(RULES)}")
+    if kind == "all":
+        if argument:
+            raise ValueError(f"Emission policy '{spec}' takes no argument")
+        return EveryRule()
+    if not argument:
+        raise ValueError(f"Emission policy '{spec}' needs an argument, e.g. '{kind}:1'")
+    try:
+        return RULES[kind](argument)
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"Emission policy '{spec}' needs a number after '{kind}:'") from None
+
+
+# Per-metric emission policy. Rules are keyed by metric name or glob pattern
+# (first match wins), metrics without one follow the default rule. State is
+# kept per series, e.g. per car, so every car gets its own deadband/window.
+class EmissionPolicy:
+    def __init__(self, rules=None, default="all"):
+        self.rules = [(pattern, parse_rule(spec)) for pattern, spec in (rules or {}).items()]
+        self.default = parse_rule(default)
+        self.resolved = {}
+        self.state = {}
+
+    # False when every metric is emitted as is, so callers can skip filtering
+    def __bool__(self):
+        return any(not isinstance(rule, EveryRule) for _, rule in self.rules) or not isinstance(self.default, EveryRule)
+
+    def rule_for(self, name):
+        try:
+            return self.resolved[name]
+        except KeyError:
+            rule = next((rule for pattern, rule in self.rules if fnmatch.fnmatchcase(name, pattern)), self.default)
+            self.resolved[name] = rule
+            return rule
+
+    def emit(self, series, name, value, now):
+        rule = self.rule_for(name)
+        if isinstance(rule, EveryRule):
+            return ((name, value),)
+        key = (series, name)
+        try:
+            state = self.state[key]
+        except KeyError:
+            state = self.state[key] = rule.new_state()
+        return rule.emit(state, name, value, now)
+
+    # Filter parallel metric names and values, returning the emitted ones
+    def filter_values(self, series, names, values, now=None):
+        now = time.monotonic() if now is None else now
+        emitted_names = []
+        emitted_values = []
+        for name, value in zip(names, values):
+            for emitted_name, emitted_value in self.emit(series, name, value, now):
+                emitted_names.append(emitted_name)
+                emitted_values.append(emitted_value)
+        return emitted_names, emitted_values
+
+    # Filter the numeric fields of a record in place. Fields in passthrough and
+    # non-numeric fields are always kept; returns None when none of the
+    # remaining fields were emitted so the whole record can be skipped.
+    def filter_record(self, series, record, passthrough=(), now=None):
+        now = time.monotonic() if now is None else now
+        emitted = {}
+        metrics = 0
+        for name, value in record.items():
+            if name in passthrough or isinstance(value, bool) or not isinstance(value, (int, float)):
+                emitted[name] = value
+                continue
+            for emitted_name, emitted_value in self.emit(series, name, value, now):
+                emitted[emitted_name] = emitted_value
+                metrics += 1
+
+        if not metrics:
+            return None
+        record.clear()
+        record.update(emitted)
+        return record
@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from telemetry.instrument import Histogram
+
+
+# A fixed set of worker threads fed from bounded queues, replacing the
+# unbounded 100 thread pool of the background package. Ordered executors give
+# every worker its own queue and send all tasks of a key to the same worker,
+# so tasks sharing state (the packets of one rig, the pages of one ACC
+# sourcetype) run one at a time in submission order; keys are spread over the
+# workers in the order they are first seen. Unordered executors
+# share one queue between their workers. A task that finds its queue full is
+# rejected and counted instead of piling up; exceptions are counted and
+# printed. Latency is measured from submit() to the end of the task.
+class Executor:
+    def __init__(self, name, workers=1, max_queue=1000, ordered=False):
+        self.name = name
+        self.ordered = ordered
+        self.queues = [queue.Queue(maxsize=max_queue) for i in range(workers if ordered else 1)]
+        self.lock = threading.Lock()
+        self.lanes = {}
+        self.counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency = Histogram()
+        self.threads = [
+            threading.Thread(target=self.run, name=f"{name}_{i}", args=(self.queues[i % len(self.queues)],), daemon=True)
+            for i in range(workers)
+        ]
+
+    # Tasks submitted before start() wait in the queues
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    # Queue fn(*args), on the worker of key for ordered executors. Returns
+    # False when the queue was full and the task rejected.
+    def submit(self, fn, *args, key=None):
+        try:
+            tasks = self.lanes[key]
+        except KeyError:
+            with self.lock:
+                tasks = self.lanes.setdefault(key, self.queues[len(self.lanes) % len(self.queues)])
+        try:
+            tasks.put_nowait((time.perf_counter(), fn, args))
+        except queue.Full:
+            with self.lock:
+                self.counters["rejected"] += 1
+            return False
+        with self.lock:
+            self.counters["submitted"] += 1
+        return True
+
+    # Decorator, calls of the decorated function are submitted instead of run
+    def task(self, fn):
+        def submit(*args):
+            return self.submit(fn, *args)
+
+        return submit
+
+    def run(self, tasks):
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            submitted, fn, args = item
+            try:
+                fn(*args)
+                counter = "completed"
+            except Exception as err:
+                print(f"{self.name}: {err!r}")
+                counter = "failed"
+            latency = time.perf_counter() - submitted
+            self.latency.observe(latency)
+            with self.lock:
+                self.counters[counter] += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            done = stats["completed"] + stats["failed"]
+            stats["latency_avg_ms"] = round(self.latency_total / done * 1000, 3) if done else 0.0
+            stats["latency_max_ms"] = round(self.latency_max * 1000, 3)
+        stats["queue_depth"] = [tasks.qsize() for tasks in self.queues] if self.ordered else self.queues[0].qsize()
+        return stats
+
+    # Run what is queued and stop the workers
+    def stop(self, timeout=5):
+        for i in range(len(self.threads)):
+            self.queues[i % len(self.queues)].put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+
+# One line of the stats of some executors
+def describe_executors(executors):
+    return " ".join(f"{executor.name}: {executor.stats()}" for executor in executors)
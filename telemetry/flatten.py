@@ -0,0 +1,194 @@
+import dataclasses
+import enum
+import fnmatch
+import operator
+import re
+import struct
+
+
+# Flat records of the ACC shared memory pages, replacing the walk over
+# data.__dict__ with type name checks on every sample. The layout of a page
+# type is compiled once, from the first sample seen: the key list and one
+# attrgetter that reads every field in a single call, nested structs (Wheels,
+# Vector3f, CarDamage and the Vector3f of a ContactPoint) as dotted paths.
+# Keys are <field>, <field>_<member> and <field>_<member>_<axis>; strings are
+# stripped of their NUL padding, enums and the fields in skip left out, list
+# fields expanded into <field>_<index> holding a dict of the element, and the
+# constant fields in extra appended. The keys and their positions are the
+# schema shared by every Snapshot of the page type.
+class Flattener:
+    def __init__(self, sample, skip=(), extra=None):
+        paths = []
+        self.keys = []
+        self.strings = []
+        self.lists = []
+        for attr, val in vars(sample).items():
+            if attr in skip or isinstance(val, enum.Enum):
+                continue
+            if isinstance(val, list):
+                self.lists.append((attr, len(val)))
+            elif dataclasses.is_dataclass(val):
+                for member, member_val in vars(val).items():
+                    if dataclasses.is_dataclass(member_val):
+                        for axis in vars(member_val):
+                            paths.append(f"{attr}.{member}.{axis}")
+                            self.keys.append(f"{attr}_{member}_{axis}")
+                    else:
+                        paths.append(f"{attr}.{member}")
+                        self.keys.append(f"{attr}_{member}")
+            else:
+                if isinstance(val, str):
+                    self.strings.append(len(paths))
+                paths.append(attr)
+                self.keys.append(attr)
+        self.keys.extend(f"{attr}_{index}" for attr, count in self.lists for index in range(count))
+        self.extra = tuple((extra or {}).values())
+        self.keys.extend(extra or {})
+        self.keys = tuple(self.keys)
+        self.index = {key: position for position, key in enumerate(self.keys)}
+        self.getter = operator.attrgetter(*paths)
+
+    # The values of a sample in the order of keys
+    def values(self, data):
+        values = self.getter(data)
+        if not self.strings and not self.lists:
+            return values + self.extra
+        values = list(values)
+        for index in self.strings:
+            values[index] = values[index].rstrip("\x00")
+        for attr, count in self.lists:
+            values.extend(dict(vars(element)) for element in getattr(data, attr))
+        values.extend(self.extra)
+        return tuple(values)
+
+    def snapshot(self, data):
+        return Snapshot(self, self.values(data))
+
+
+# Flat records read straight from a shared memory page, without parsing it
+# into pyaccsharedmemory's dataclasses first. fields is the page in memory
+# order: (key, code) for a value, (key, code, members) for a struct of
+# several values flattened into <key>_<member>, and (None, code, count) for
+# count unused values that are skipped. Codes are struct codes of 4 bytes, ?
+# is a 4 byte int flag shipped as a bool. The whole page is one
+# struct.Struct, a sample is a single unpack_from on the mapping. Keys and
+# order are the same as a Flattener of the parsed page gives.
+class PageLayout:
+    def __init__(self, fields, extra=None):
+        layout = "="
+        keys = []
+        self.bools = []
+        for field in fields:
+            key, code = field[:2]
+            members = field[2] if len(field) > 2 else None
+            if key is None:
+                layout += f"{4 * (members or 1)}x"
+                continue
+            if code == "?":
+                self.bools.append(len(keys))
+                code = "i"
+            if members is None:
+                keys.append(key)
+                layout += code
+            else:
+                keys.extend(f"{key}_{member}" for member in members)
+                layout += f"{len(members)}{code}"
+        self.struct = struct.Struct(layout)
+        self.extra = tuple((extra or {}).values())
+        keys.extend(extra or {})
+        self.keys = tuple(keys)
+        self.index = {key: position for position, key in enumerate(self.keys)}
+
+    def values(self, buffer):
+        values = self.struct.unpack_from(buffer)
+        if not self.bools:
+            return values + self.extra
+        values = list(values)
+        for index in self.bools:
+            values[index] = bool(values[index])
+        values.extend(self.extra)
+        return tuple(values)
+
+    def snapshot(self, buffer):
+        return Snapshot(self, self.values(buffer))
+
+
+# One flattened sample: the values as a tuple next to the schema of its page
+# type. It is never changed after it is taken, so the HEC and O11y senders
+# can serialise it on other threads while the next sample is flattened. Reads
+# like a read-only dict.
+class Snapshot:
+    __slots__ = ("schema", "values")
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.schema.index[key]]
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self.values)
+
+    def items(self):
+        return zip(self.schema.keys, self.values)
+
+    def as_dict(self):
+        return dict(zip(self.schema.keys, self.values))
+
+
+# Which snapshot fields go to O11y: exact keys, glob patterns (* ? [...])
+# and regular expressions prefixed with re:. The patterns are matched against
+# the keys of a schema once, when its first snapshot is selected from, and
+# compiled into the metric names and an itemgetter of their positions, so
+# selecting the metrics of a sample is a single gather.
+class MetricSelection:
+    def __init__(self, patterns, prefix=""):
+        self.prefix = prefix
+        self.exact = set()
+        self.globs = []
+        self.regexes = []
+        for pattern in patterns:
+            if pattern.startswith("re:"):
+                self.regexes.append(re.compile(pattern[3:]))
+            elif any(char in pattern for char in "*?["):
+                self.globs.append(pattern)
+            else:
+                self.exact.add(pattern)
+        self.plans = {}
+
+    def matches(self, key):
+        return key in self.exact or any(fnmatch.fnmatchcase(key, glob) for glob in self.globs) or any(regex.fullmatch(key) for regex in self.regexes)
+
+    def plan(self, schema):
+        try:
+            return self.plans[schema]
+        except KeyError:
+            positions = [position for position, key in enumerate(schema.keys) if self.matches(key)]
+            names = tuple(self.prefix + schema.keys[position] for position in positions)
+            if len(positions) == 1:
+                position = positions[0]
+                getter = lambda values: (values[position],)
+            else:
+                getter = operator.itemgetter(*positions) if positions else lambda values: ()
+            plan = self.plans[schema] = (names, getter)
+            return plan
+
+    # (metric name, value) of every selected field of a snapshot
+    def select(self, snapshot):
+        names, getter = self.plan(snapshot.schema)
+        return zip(names, getter(snapshot.values))
+
+
+flatteners = {}
+
+
+def flattener_for(data, skip=(), extra=None):
+    try:
+        return flatteners[type(data)]
+    except KeyError:
+        flattener = flatteners[type(data)] = Flattener(data, skip, extra)
+        return flattener
@@ -0,0 +1,214 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Latency histogram with fixed buckets, cheap enough to observe every packet
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += seconds
+
+    # Cumulative bucket counts, the last one being the total count, and the sum
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+# Counters and histograms of one listener, named <prefix><name>, rendered in
+# the Prometheus text format for /metrics and flattened for O11y. Values kept
+# elsewhere (sender and executor stats) are read at render time by collectors,
+# functions returning (name, labels, value, kind) tuples.
+class Registry:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name, histogram=None, **labels):
+        key = (name, label_key(labels))
+        try:
+            return self.histograms[key]
+        except KeyError:
+            with self.lock:
+                return self.histograms.setdefault(key, histogram or Histogram())
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    # Every counter and gauge as (name, labels, value, kind)
+    def samples(self):
+        with self.lock:
+            samples = [(name, labels, value, "counter") for (name, labels), value in self.counters.items()]
+        for collector in self.collectors:
+            samples.extend((name, label_key(labels), value, kind) for name, labels, value, kind in collector())
+        return samples
+
+    def render(self):
+        lines = []
+        families = {}
+        for name, labels, value, kind in self.samples():
+            families.setdefault((name, kind), []).append((labels, value))
+        for (name, kind), values in sorted(families.items()):
+            lines.append(f"# TYPE {self.prefix}{name} {kind}")
+            lines.extend(f"{self.prefix}{name}{format_labels(labels)} {value}" for labels, value in values)
+
+        by_name = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, histograms in sorted(by_name.items()):
+            lines.append(f"# TYPE {self.prefix}{name} histogram")
+            for labels, histogram in histograms:
+                cumulative, total = histogram.snapshot()
+                for bound, count in zip(histogram.buckets, cumulative):
+                    lines.append(f"{self.prefix}{name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{self.prefix}{name}_bucket{format_labels(labels, [('le', '+Inf')])} {cumulative[-1]}")
+                lines.append(f"{self.prefix}{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.prefix}{name}_count{format_labels(labels)} {cumulative[-1]}")
+        return "\n".join(lines) + "\n"
+
+    # Counters and gauges as O11y datapoints; histograms as their count and
+    # sum counters plus the average since the previous call as a gauge
+    def datapoints(self, dimensions, previous):
+        counters = []
+        gauges = []
+        for name, labels, value, kind in self.samples():
+            datapoint = {"metric": self.prefix + name, "value": value, "dimensions": dict(dimensions, **dict(labels))}
+            (counters if kind == "counter" else gauges).append(datapoint)
+        for (name, labels), histogram in list(self.histograms.items()):
+            cumulative, total = histogram.snapshot()
+            point_dimensions = dict(dimensions, **dict(labels))
+            counters.append({"metric": f"{self.prefix}{name}_count", "value": cumulative[-1], "dimensions": point_dimensions})
+            last_count, last_total = previous.get((name, labels), (0, 0.0))
+            if cumulative[-1] > last_count:
+                gauges.append({"metric": f"{self.prefix}{name}_avg", "value": (total - last_total) / (cumulative[-1] - last_count), "dimensions": point_dimensions})
+            previous[(name, labels)] = (cumulative[-1], total)
+        return counters, gauges
+
+
+# Stats of a BatchSender: queue depth, shipped, dropped and failed events and
+# the latency from queueing an event to the collector acknowledging it
+def watch_sender(registry, sender):
+    registry.histogram("egress_ack_seconds", sender.latency, sender=sender.name)
+
+    def collect():
+        stats = sender.stats()
+        return [
+            ("egress_queue_depth", {"sender": sender.name}, stats["queue_depth"], "gauge"),
+            ("egress_sent_total", {"sender": sender.name}, stats["sent"], "counter"),
+            ("egress_dropped_total", {"sender": sender.name}, stats["dropped"], "counter"),
+            ("egress_errors_total", {"sender": sender.name}, stats["failed"], "counter"),
+        ]
+
+    registry.collect(collect)
+
+
+# Stats of an Executor: queue depth, completed, failed and rejected tasks and
+# the latency from submitting a task to its end
+def watch_executor(registry, executor):
+    registry.histogram("executor_task_seconds", executor.latency, executor=executor.name)
+
+    def collect():
+        stats = executor.stats()
+        depth = stats["queue_depth"]
+        return [
+            ("executor_queue_depth", {"executor": executor.name}, sum(depth) if isinstance(depth, list) else depth, "gauge"),
+            ("executor_completed_total", {"executor": executor.name}, stats["completed"], "counter"),
+            ("executor_failed_total", {"executor": executor.name}, stats["failed"], "counter"),
+            ("executor_rejected_total", {"executor": executor.name}, stats["rejected"], "counter"),
+        ]
+
+    registry.collect(collect)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serve the registry on http://host:port/metrics from a daemon thread
+def serve_metrics(registry, port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics_server", daemon=True).start()
+    return server
+
+
+# Ships the registry to O11y every interval seconds. Stop it before the
+# ingest client, a send after ingest.stop() restarts the client's thread.
+class SelfMetrics:
+    def __init__(self, registry, ingest, interval, dimensions):
+        self.registry = registry
+        self.ingest = ingest
+        self.interval = interval
+        self.dimensions = dimensions
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="self_metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        previous = {}
+        while not self.stopped.wait(self.interval):
+            counters, gauges = self.registry.datapoints(self.dimensions, previous)
+            self.ingest.send(cumulative_counters=counters, gauges=gauges)
+
+    def stop(self, timeout=5):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,79 @@
+import sqlite3
+import threading
+
+
+# Cached view of the players table for the listeners. Player names are served
+# from memory and only reloaded when another connection changed the database
+# (PRAGMA data_version moves on every commit but our own), and the live
+# throttle/speed/brake values are coalesced per hostname and written by one
+# thread at most every interval seconds on a WAL connection, so no packet
+# waits on SQLite.
+class PlayerRegistry:
+    def __init__(self, database, interval=1.0, on_change=None):
+        self.database = database
+        self.interval = interval
+        self.on_change = on_change
+        self.names = {}
+        self.live = {}
+        self.version = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.reload()
+        self.thread = threading.Thread(target=self.run, name="player_registry", daemon=True)
+        self.thread.start()
+        return self
+
+    def name(self, hostname):
+        return self.names.get(hostname)
+
+    # Latest live values of a rig, only the last one per interval is written
+    def update(self, hostname, throttle, speed, brake):
+        with self.lock:
+            self.live[hostname] = (throttle, speed, brake)
+
+    # Reload the names if the table changed since the last look, returns True if it did
+    def reload(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version:
+            return False
+        self.version = version
+        self.names = dict(self.conn.execute("SELECT hostname, player_name FROM players"))
+        return True
+
+    # Errors are printed and the next flush tries again with the values that
+    # were not written (unless newer ones came in meanwhile), so a failing
+    # write or on_change callback never ends the thread
+    def flush(self):
+        with self.lock:
+            live, self.live = self.live, {}
+        try:
+            if live:
+                self.conn.executemany("UPDATE players SET throttle = ?, speed = ?, brake = ? WHERE hostname = ?", [(*values, hostname) for hostname, values in live.items()])
+                self.conn.commit()
+                live = None
+            if self.reload() and self.on_change is not None:
+                self.on_change(self.names)
+        except Exception as err:
+            print(f"player_registry: {err!r}")
+            if live:
+                with self.lock:
+                    for hostname, values in live.items():
+                        self.live.setdefault(hostname, values)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+        self.flush()
+        self.conn.close()
+
+    # Write the last live values and close the connection
+    def stop(self, timeout=5):
+        self.stopped.set()
+        self.thread.join(timeout)
@@ -0,0 +1,76 @@
+import collections
+import selectors
+import time
+
+SLOT_SIZE = 2048
+
+
+# Preallocated receive buffers: one bytearray cut into fixed size slots that
+# are handed out and given back by index, so receiving allocates no bytes
+# objects. A slot belongs to whoever took it until release(); the datagram in
+# it must be copied (ctypes from_buffer_copy does) or processed before that.
+class BufferRing:
+    def __init__(self, slots=4096, slot_size=SLOT_SIZE):
+        self.slot_size = slot_size
+        self.view = memoryview(bytearray(slots * slot_size))
+        self.slots = [self.view[slot * slot_size : (slot + 1) * slot_size] for slot in range(slots)]
+        # deque append and popleft are atomic, receiver and decoders share it without a lock
+        self.free = collections.deque(range(slots))
+        self.exhausted = 0
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def release_all(self, batch):
+        for slot, datagram in batch:
+            self.free.append(slot)
+
+
+# Drains up to batch datagrams per wakeup from a non-blocking UDP socket into
+# a BufferRing with recv_into. Python has no recvmmsg, this is the closest:
+# one system call per datagram but no allocation, and one wakeup and one
+# hand-off to the decoder per batch instead of per datagram. Each datagram is
+# returned as (slot, memoryview) and its slot has to be released by the
+# consumer. When the ring is exhausted the rest stays in the kernel buffer.
+class BatchReceiver:
+    def __init__(self, sock, ring, batch=64):
+        self.sock = sock
+        self.ring = ring
+        self.batch = batch
+        sock.setblocking(False)
+        self.selector = None
+
+    # The datagrams waiting on the socket; with wait, blocks until there is one
+    def receive(self, wait=False):
+        batch = []
+        free = self.ring.free
+        slots = self.ring.slots
+        stalled = False
+        while len(batch) < self.batch:
+            try:
+                slot = free.popleft()
+            except IndexError:
+                if not stalled:
+                    self.ring.exhausted += 1
+                    stalled = True
+                if batch or not wait:
+                    break
+                # Every slot is still being decoded, give the decoders a moment
+                time.sleep(0.001)
+                continue
+            try:
+                size = self.sock.recv_into(slots[slot])
+            except BlockingIOError:
+                free.appendleft(slot)
+                if batch or not wait:
+                    break
+                self.wait()
+                continue
+            batch.append((slot, slots[slot][:size]))
+        return batch
+
+    def wait(self):
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.select()
@@ -0,0 +1,271 @@
+import ctypes
+import json
+import math
+import struct
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+# struct codes by size for integer fields; ctypes codes such as "L" change
+# size between platforms while the packets are fixed little-endian layouts
+INTEGER_CODES = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+
+# Flat records read straight from a ctypes struct, replacing the
+# to_json() -> json.loads() -> flatten round trip. The fields of a struct
+# type are compiled once into a struct.Struct and a key table in the layout
+# that round trip produced: scalar fields in name order, then array fields
+# in name order expanded into field1..fieldN. Scalar floats are rounded to 3
+# places and char arrays decoded, as to_json does; elements of arrays are
+# left as they are.
+class RecordLayout:
+    def __init__(self, cls):
+        scalars = []
+        arrays = []
+        for name, ctype in sorted(cls._fields_):
+            offset = getattr(cls, name).offset
+            if issubclass(ctype, ctypes.Array) and ctype._type_ is ctypes.c_char:
+                scalars.append((name, offset, f"{ctype._length_}s"))
+            elif issubclass(ctype, ctypes.Array) and not issubclass(ctype._type_, ctypes.Structure):
+                size = ctypes.sizeof(ctype._type_)
+                code = struct_code(ctype._type_)
+                arrays.extend((name + str(index + 1), offset + index * size, code) for index in range(ctype._length_))
+            elif issubclass(ctype, (ctypes.Array, ctypes.Structure)):
+                raise TypeError(f"{cls.__name__}.{name} is a nested struct, records can only be read from flat structs")
+            else:
+                scalars.append((name, offset, struct_code(ctype)))
+
+        columns = scalars + arrays
+        self.keys = tuple(name for name, _, _ in columns)
+        self.floats = [position for position, (_, _, code) in enumerate(scalars) if code in "fd"]
+        self.texts = [position for position, (_, _, code) in enumerate(scalars) if code.endswith("s")]
+
+        by_offset = sorted(range(len(columns)), key=lambda position: columns[position][1])
+        layout = "<"
+        position = 0
+        for column in by_offset:
+            _, offset, code = columns[column]
+            layout += "x" * (offset - position) + code
+            position = offset + struct.calcsize("<" + code)
+        layout += "x" * (ctypes.sizeof(cls) - position)
+        self.struct = struct.Struct(layout)
+
+        self.order = [by_offset.index(column) for column in range(len(columns))]
+        if self.order == list(range(len(columns))):
+            self.order = None
+
+        # The same columns as a NumPy structured dtype for the columnar mode
+        self.dtype = None
+        if numpy is not None:
+            formats = [("S" + code[:-1]) if code.endswith("s") else "<" + code for _, _, code in columns]
+            self.dtype = numpy.dtype({"names": list(self.keys), "formats": formats, "offsets": [offset for _, offset, _ in columns], "itemsize": ctypes.sizeof(cls)})
+
+    def values(self, unpacked):
+        values = list(unpacked) if self.order is None else [unpacked[i] for i in self.order]
+        for i in self.floats:
+            values[i] = round(values[i], 3)
+        for i in self.texts:
+            values[i] = values[i].split(b"\0", 1)[0].decode()
+        return values
+
+    # One record of a struct instance or of a buffer at offset
+    def record(self, buffer, offset=0):
+        return dict(zip(self.keys, self.values(self.struct.unpack_from(buffer, offset))))
+
+    # One record per element of count consecutive structs starting at offset
+    def records(self, buffer, offset, count):
+        view = memoryview(buffer).cast("B")[offset : offset + count * self.struct.size]
+        keys = self.keys
+        return [dict(zip(keys, self.values(unpacked))) for unpacked in self.struct.iter_unpack(view)]
+
+    # Per-field arrays of count consecutive structs, a NumPy view of the
+    # buffer without copying
+    def columns(self, buffer, offset, count):
+        return numpy.frombuffer(buffer, dtype=self.dtype, count=count, offset=offset)
+
+    # records() computed a column at a time: floats of every struct are
+    # rounded in one vectorised call and each column converted to Python
+    # values in C before the rows are zipped together
+    def columnar_records(self, buffer, offset, count):
+        structs = self.columns(buffer, offset, count)
+        columns = [structs[key] for key in self.keys]
+        with numpy.errstate(invalid="ignore"):
+            for i in self.floats:
+                columns[i] = columns[i].astype(numpy.float64).round(3)
+        columns = [column.tolist() for column in columns]
+        for i in self.texts:
+            columns[i] = [value.split(b"\0", 1)[0].decode() for value in columns[i]]
+        keys = self.keys
+        return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def struct_code(ctype):
+    code = ctype._type_
+    if code in "fd?c":
+        return code
+    signed = INTEGER_CODES[ctypes.sizeof(ctype)]
+    return signed.upper() if code.isupper() else signed
+
+
+layouts = {}
+
+
+def layout_for(cls):
+    try:
+        return layouts[cls]
+    except KeyError:
+        layout = layouts[cls] = RecordLayout(cls)
+        return layout
+
+
+# Records of every element of an array-of-structs field of a packet,
+# columnar decodes them with NumPy
+def array_records(packet, field, columnar=False):
+    ctype = dict(type(packet)._fields_)[field]
+    layout = layout_for(ctype._type_)
+    if columnar:
+        return layout.columnar_records(packet, getattr(type(packet), field).offset, ctype._length_)
+    return layout.records(packet, getattr(type(packet), field).offset, ctype._length_)
+
+
+# Value of a single field formatted the way to_json formats it
+def field_value(obj, field):
+    value = getattr(obj, field)
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, ctypes.Array):
+        return list(value)
+    return value
+
+
+NUMBERS = (int, float, bool)
+
+
+# Escaped body of the JSON string of a value
+def json_text(value):
+    return json.dumps(str(value))[1:-1]
+
+
+# Serialises records as HEC events with every event field as a string, the
+# way the listeners have always sent them, byte for byte what json.dumps of
+# the stringified record gives. The JSON of the envelope and of the keys is
+# built once per key set and the values are spliced into a %-template, so
+# only non-numeric values go through the JSON encoder.
+class HecEncoder:
+    def __init__(self, source, host):
+        self.source = source
+        self.host = host
+        self.templates = {}
+
+    def template(self, keys):
+        template = ", ".join(json.dumps(key).replace("%", "%%") + ': "%s"' for key in keys)
+        if len(self.templates) > 256:
+            self.templates.clear()
+        self.templates[keys] = template
+        return template
+
+    def encode(self, rows, sourcetype, timestamp):
+        envelope = '{"time": %s, "sourcetype": %s, "source": %s, "host": %s, "event": {' % (
+            json.dumps(timestamp), json.dumps(sourcetype), json.dumps(self.source), json.dumps(self.host))
+        events = []
+        for row in rows:
+            keys = tuple(row)
+            try:
+                template = self.templates[keys]
+            except KeyError:
+                template = self.template(keys)
+            values = tuple(value if value.__class__ in NUMBERS else json_text(value) for value in row.values())
+            events.append(envelope + template % values + "}}")
+        return "\n".join(events).encode()
+
+
+# Serialises records as Splunk multi-metric HEC events, one event per record
+# with every numeric field as a metric_name:<prefix><field> measurement and
+# text fields as dimensions, values kept numeric. Fields in dimensions are
+# always dimensions, fields in skip are left out (e.g. per-packet counters
+# that would only add cardinality), and NaN or infinite values, which HEC
+# rejects, are dropped. As in HecEncoder the JSON of the envelope and of the
+# field names is built once, per key set and value types, and the values are
+# spliced into a %-template; rows with a NaN or infinite value take the slow
+# path through json.dumps.
+class MetricEncoder:
+    def __init__(self, prefix, source, host, dimensions=(), skip=(), index=None):
+        self.prefix = prefix
+        self.source = source
+        self.host = host
+        self.dimensions = set(dimensions)
+        self.skip = set(skip)
+        self.index = index
+        self.names = {}
+        self.templates = {}
+
+    def metric_name(self, key):
+        try:
+            return self.names[key]
+        except KeyError:
+            name = self.names[key] = "metric_name:" + self.prefix + key
+            return name
+
+    def fields(self, row):
+        fields = {}
+        for key, value in row.items():
+            if key in self.skip:
+                continue
+            if key in self.dimensions or value.__class__ is str:
+                fields[key] = str(value)
+            elif value.__class__ is int or value.__class__ is float and math.isfinite(value):
+                fields[self.metric_name(key)] = value
+        return fields
+
+    # Template of the fields of rows with these keys and value classes, the
+    # positions of the values it takes (and whether each is a dimension) and
+    # the positions of the float values
+    def template(self, keys, classes):
+        parts = []
+        positions = []
+        floats = []
+        for position, (key, cls) in enumerate(zip(keys, classes)):
+            if key in self.skip:
+                continue
+            if key in self.dimensions or cls is str:
+                parts.append(json.dumps(key).replace("%", "%%") + ':"%s"')
+                positions.append((position, True))
+            elif cls is int or cls is float:
+                parts.append(json.dumps(self.metric_name(key)).replace("%", "%%") + ":%s")
+                positions.append((position, False))
+                if cls is float:
+                    floats.append(position)
+        if len(self.templates) > 256:
+            self.templates.clear()
+        template = self.templates[(keys, classes)] = (",".join(parts), positions, floats)
+        return template
+
+    def slow_event(self, row, sourcetype, timestamp):
+        event = {"time": timestamp, "event": "metric", "sourcetype": sourcetype, "host": self.host, "source": self.source}
+        if self.index:
+            event["index"] = self.index
+        event["fields"] = self.fields(row)
+        return json.dumps(event, separators=(",", ":"))
+
+    def encode(self, rows, sourcetype, timestamp):
+        envelope = '{"time":%s,"event":"metric","sourcetype":%s,"host":%s,"source":%s,%s"fields":{' % (
+            json.dumps(timestamp), json.dumps(sourcetype), json.dumps(self.host), json.dumps(self.source),
+            '"index":%s,' % json.dumps(self.index) if self.index else "")
+        events = []
+        for row in rows:
+            values = tuple(row.values())
+            key = (tuple(row), tuple(value.__class__ for value in values))
+            try:
+                template, positions, floats = self.templates[key]
+            except KeyError:
+                template, positions, floats = self.template(*key)
+            if floats and not math.isfinite(sum(values[position] for position in floats)):
+                events.append(self.slow_event(row, sourcetype, timestamp))
+                continue
+            fields = tuple(json_text(values[position]) if dimension else values[position] for position, dimension in positions)
+            events.append(envelope + template % fields + "}}")
+        return "\n".join(events).encode()
@@ -0,0 +1,81 @@
+import ctypes
+import struct
+from operator import attrgetter
+
+
+# Declares the field-to-metric mapping of a packet struct once instead of
+# rebuilding a list of datapoint dicts per packet. Fields are
+# (metric, attribute) or (metric, attribute, index) for array attributes such
+# as the four brake temperatures.
+#
+# On first sight of a ctypes struct type the fields are compiled into a single
+# struct.Struct that unpacks every value straight from the packet's buffer, so
+# read() costs one C call and one tuple per packet. Values keep their type,
+# integer fields (gear, lap numbers, lap times in ms) stay ints in the HEC
+# events and O11y datapoints. The datapoint dicts are only built by the
+# sender thread via gauges().
+class MetricSchema:
+    def __init__(self, prefix, fields):
+        self.fields = [(field[1], field[2] if len(field) > 2 else None) for field in fields]
+        self.metrics = tuple(prefix + field[0] for field in fields)
+        self.hec_keys = tuple("metric_name:" + metric for metric in self.metrics)
+        self.layouts = {}
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def read(self, obj):
+        try:
+            unpack, order = self.layouts[type(obj)]
+        except KeyError:
+            unpack, order = self.layouts[type(obj)] = self.compile(type(obj))
+
+        values = unpack(obj)
+        if order is None:
+            return tuple(values)
+        return tuple([values[i] for i in order])
+
+    # Build the unpacker for one struct type; objects that are not ctypes
+    # structs fall back to attribute lookups
+    def compile(self, cls):
+        if not issubclass(cls, ctypes.Structure):
+            getters = [attrgetter(attribute) for attribute, _ in self.fields]
+            fields = self.fields
+
+            def unpack(obj):
+                return [getter(obj) if index is None else getter(obj)[index] for getter, (_, index) in zip(getters, fields)]
+
+            return unpack, None
+
+        types = dict(cls._fields_)
+        columns = []
+        for attribute, index in self.fields:
+            ctype = types[attribute]
+            offset = getattr(cls, attribute).offset
+            if index is not None:
+                ctype = ctype._type_
+                offset += index * ctypes.sizeof(ctype)
+            columns.append((offset, ctype._type_, ctypes.sizeof(ctype)))
+
+        unique = sorted(set(columns))
+        layout = "<"
+        position = 0
+        for offset, code, size in unique:
+            layout += "x" * (offset - position) + code
+            position = offset + size
+
+        order = [unique.index(column) for column in columns]
+        if order == list(range(len(unique))):
+            order = None
+        return struct.Struct(layout).unpack_from, order
+
+    def gauges(self, values, dimensions):
+        return [{"metric": metric, "value": value, "dimensions": dimensions} for metric, value in zip(self.metrics, values)]
+
+    def hec_fields(self, values):
+        return dict(zip(self.hec_keys, values))
+
+
+# Expands into the per-wheel fields of an array attribute in FL, FR, RL, RR order
+def wheels(metric, attribute):
+    return [(metric + wheel, attribute, index) for index, wheel in enumerate(("FL", "FR", "RL", "RR"))]
@@ -0,0 +1,136 @@
+import socket
+import statistics
+import struct
+import threading
+from telemetry.records import struct_code
+
+# Packet ids sent several times in the same frame (events), never duplicates
+MULTIPLE_PER_FRAME = (3,)
+# Packet ids sent when something happens rather than at a rate (events, final
+# classification): a gap between them is no loss, they are only checked for
+# duplicates and order
+NON_PERIODIC = MULTIPLE_PER_FRAME + (8,)
+# Strides a packet may arrive late; a frame further back is taken for a
+# rewind of the frame counter (flashback, restart of the session)
+REORDER_STRIDES = 3
+# Deltas kept per packet id to learn its frame stride
+STRIDE_SAMPLES = 64
+
+
+# State of one packet id within one session
+class Sequence:
+    __slots__ = ("last", "stride", "deltas", "gap", "received", "lost", "duplicates", "out_of_order")
+
+    def __init__(self, frame):
+        self.last = frame
+        self.stride = 0
+        self.deltas = []
+        # First and last frame and lost packets of the last gap
+        self.gap = None
+        self.received = 1
+        self.lost = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+
+
+# Counts lost, duplicate and out of order packets from the session uid and
+# frame identifier of the packet headers, per packet id. The game sends most
+# packet types at a fixed rate but not on every frame (and some only a few
+# times a second), so the frame stride of every packet id is learnt as the
+# median of its recent frame deltas and a delta of n strides counts n - 1
+# lost packets; the non-periodic packet ids are never counted as lost. A frame
+# older than the last one is out of order, unless it is more than a few
+# strides older, which is a rewind of the frame counter and starts the
+# sequence over from that frame. A late frame inside the last gap was counted
+# as lost when the gap was seen, so that loss is taken back. Reads the raw
+# datagram header, so it runs on the receive loop in arrival order.
+class SequenceTracker:
+    def __init__(self, header, session_field, frame_field, packet_id_field):
+        fields = dict(header._fields_)
+        self.layout = [(getattr(header, name).offset, struct.Struct("<" + struct_code(fields[name]))) for name in (session_field, frame_field, packet_id_field)]
+        self.session = None
+        self.sequences = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def track(self, datagram):
+        session, frame, packet_id = (layout.unpack_from(datagram, offset)[0] for offset, layout in self.layout)
+        if session != self.session:
+            with self.lock:
+                self.close_session()
+                self.session = session
+        sequence = self.sequences.get(packet_id)
+        if sequence is None:
+            self.sequences[packet_id] = Sequence(frame)
+            return
+        sequence.received += 1
+        delta = frame - sequence.last
+        if delta > 0 and packet_id in NON_PERIODIC:
+            sequence.last = frame
+        elif delta > 0:
+            if sequence.stride and delta > 1.5 * sequence.stride:
+                lost = round(delta / sequence.stride) - 1
+                sequence.lost += lost
+                sequence.gap = [sequence.last, frame, lost]
+            sequence.deltas.append(delta)
+            if len(sequence.deltas) >= STRIDE_SAMPLES:
+                sequence.stride = statistics.median(sequence.deltas)
+                sequence.deltas.clear()
+            elif not sequence.stride and len(sequence.deltas) >= 8:
+                sequence.stride = statistics.median(sequence.deltas)
+            sequence.last = frame
+        elif delta == 0:
+            if packet_id not in MULTIPLE_PER_FRAME:
+                sequence.duplicates += 1
+        elif -delta <= REORDER_STRIDES * max(sequence.stride, 1):
+            sequence.out_of_order += 1
+            gap = sequence.gap
+            if gap and gap[0] < frame < gap[1] and gap[2]:
+                gap[2] -= 1
+                sequence.lost -= 1
+        else:
+            sequence.last = frame
+            sequence.deltas.clear()
+            sequence.gap = None
+
+    # Fold the counts of the finished session into the totals
+    def close_session(self):
+        for packet_id, sequence in self.sequences.items():
+            total = self.totals.setdefault(packet_id, [0, 0, 0, 0])
+            total[0] += sequence.received
+            total[1] += sequence.lost
+            total[2] += sequence.duplicates
+            total[3] += sequence.out_of_order
+        self.sequences = {}
+
+    # Received, lost, duplicate and out of order packets per packet id over all sessions
+    def stats(self):
+        with self.lock:
+            stats = {packet_id: list(total) for packet_id, total in self.totals.items()}
+            for packet_id, sequence in list(self.sequences.items()):
+                total = stats.setdefault(packet_id, [0, 0, 0, 0])
+                total[0] += sequence.received
+                total[1] += sequence.lost
+                total[2] += sequence.duplicates
+                total[3] += sequence.out_of_order
+        return {packet_id: dict(zip(("received", "lost", "duplicates", "out_of_order"), total)) for packet_id, total in stats.items()}
+
+
+# Counters and loss ratio of a tracker for a Registry, labelled with labels
+def sequence_samples(tracker, **labels):
+    samples = []
+    for packet_id, stats in tracker.stats().items():
+        packet_labels = dict(labels, packet_id=packet_id)
+        samples.append(("packets_lost_total", packet_labels, stats["lost"], "counter"))
+        samples.append(("packets_duplicate_total", packet_labels, stats["duplicates"], "counter"))
+        samples.append(("packets_out_of_order_total", packet_labels, stats["out_of_order"], "counter"))
+        expected = stats["received"] + stats["lost"]
+        samples.append(("packet_loss_ratio", packet_labels, stats["lost"] / expected if expected else 0.0, "gauge"))
+    return samples
+
+
+# Ask for a receive buffer of size bytes, returns what the kernel granted
+# (Linux doubles the request and caps it at net.core.rmem_max)
+def set_receive_buffer(sock, size):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
@@ -1,41 +1,177 @@
 import socket
+import queue
+import threading
+import time
 import yaml
 import telemetry.splunk as metrics
+from telemetry.egress import describe_wire
+from telemetry.sequence import SequenceTracker, sequence_samples, set_receive_buffer
+from telemetry.instrument import Registry, SelfMetrics, serve_metrics, watch_sender
+from telemetry.receiver import BufferRing, BatchReceiver
 from telemetry_f1_2021.listener import TelemetryListener
+from telemetry_f1_2021.packets import PacketHeader, HEADER_FIELD_TO_PACKET_TYPE
 from socket import gethostname, getfqdn, gethostbyname
 
 with open("config.yaml", "r") as ymlfile:
     cfg = yaml.safe_load(ymlfile)
 
+# Datagrams waiting to be decoded and processed by the processing thread; the
+# receive loop never blocks on it and counts a drop instead when it is full.
+# With UDP_BATCH the items are whole batches of datagrams in ring slots.
+packets = queue.Queue(maxsize=cfg.get("PACKET_QUEUE_SIZE", 1000))
+ring = BufferRing(cfg.get("UDP_RING_SLOTS", 4096)) if cfg.get("UDP_BATCH") else None
+counters = {"received": 0, "dropped": 0, "processed": 0, "failed": 0}
+
+# Instrumentation: latency of every stage of a packet from the datagram being
+# read to the metrics being handed to the senders and the senders' HTTP
+# acknowledgement, packets per packet id, drops and egress errors
+registry = Registry("f1_2021_")
+stage_latency = {stage: registry.histogram("stage_seconds", stage=stage) for stage in ("queue", "decode", "process", "total")}
+packet_counts = [0] * 256
+registry.collect(lambda: [("packets_total", {"packet_id": packet_id}, count, "counter") for packet_id, count in enumerate(packet_counts) if count])
+registry.collect(lambda: [("packets_dropped_total", {}, counters["dropped"], "counter"), ("packets_failed_total", {}, counters["failed"], "counter"), ("packet_queue_depth", {}, packets.qsize(), "gauge")])
+watch_sender(registry, metrics.hec)
+watch_sender(registry, metrics.o11y)
+
+# Lost, duplicate and out of order packets from the header frame identifiers
+sequence = SequenceTracker(PacketHeader, "m_session_uid", "m_frame_identifier", "m_packet_id")
+registry.collect(lambda: sequence_samples(sequence))
+if ring is not None:
+    registry.collect(lambda: [("receive_ring_exhausted_total", {}, ring.exhausted, "counter"), ("receive_ring_free", {}, len(ring.free), "gauge")])
+
+PACKET_ID_OFFSET = PacketHeader.m_packet_id.offset
+
+
+def unpack_packet(datagram):
+    header = PacketHeader.from_buffer_copy(datagram)
+    return HEADER_FIELD_TO_PACKET_TYPE[(header.m_packet_format, header.m_packet_version, header.m_packet_id)].unpack(datagram)
+
+
+# A packet that fails to decode or process (another game's format, a car
+# index out of range) is counted and logged, the thread carries on
+def process_packets(driver_name):
+    while True:
+        received, item = packets.get()
+        if ring is None:
+            try:
+                process_packet(driver_name, received, item)
+            except Exception as err:
+                counters["failed"] += 1
+                print(f"process_packets: {err!r}")
+            continue
+        for slot, datagram in item:
+            try:
+                process_packet(driver_name, received, datagram)
+            except Exception as err:
+                counters["failed"] += 1
+                print(f"process_packets: {err!r}")
+            finally:
+                ring.release(slot)
+
+
+def process_packet(driver_name, received, datagram):
+    started = time.perf_counter()
+    packet = unpack_packet(datagram)
+    decoded = time.perf_counter()
+    packet_type = packet.m_header.m_packet_id  # get the packet type from the header
+    position = packet.m_header.m_player_car_index  # get the position of the driver
+    session_uid = packet.m_header.m_session_uid  # get the session uid
+
+    # SESSION DATA
+    if packet_type == 1:
+        if position is not None:
+            metrics.set_dimensions(session_uid, driver_name, packet.m_track_id)
+        metrics.write_temperatures(packet.m_track_temperature, packet.m_air_temperature)
+
+    # LAP DATA
+    if packet_type == 2:
+        metrics.write_lap_data(packet.m_lap_data[position])
+
+    # TELEMETRY DATA
+    if packet_type == 6:
+        metrics.write_telemetry_data(packet.m_car_telemetry_data[position])
+
+    counters["processed"] += 1
+    processed = time.perf_counter()
+    stage_latency["queue"].observe(started - received)
+    stage_latency["decode"].observe(decoded - started)
+    stage_latency["process"].observe(processed - decoded)
+    stage_latency["total"].observe(processed - received)
+
+
+# Periodically print packets received against what the egress senders shipped
+def report_stats(interval):
+    previous = {}
+    while True:
+        time.sleep(interval)
+        egress = metrics.stats()
+        sequences = sequence.stats().values()
+        lost = sum(packet["lost"] for packet in sequences)
+        print(
+            f"Packets received: {counters['received']} lost: {lost} ({lost / max(counters['received'] + lost, 1) * 100:.2f}%) "
+            + f"duplicates: {sum(packet['duplicates'] for packet in sequences)} out of order: {sum(packet['out_of_order'] for packet in sequences)} "
+            + f"dropped: {counters['dropped']} processed: {counters['processed']} failed: {counters['failed']} | "
+            + f"HEC shipped: {egress['hec']['sent']} dropped: {egress['hec']['dropped']} failed: {egress['hec']['failed']} spooled: {egress['hec']['spooled']} "
+            + f"{describe_wire(egress['hec'], previous, interval)} | "
+            + f"O11y shipped: {egress['o11y']['sent']} dropped: {egress['o11y']['dropped']} failed: {egress['o11y']['failed']}"
+        )
+        previous = egress["hec"]
+
+
+# Receive loop of UDP_BATCH mode: drains the socket into the ring and queues
+# every batch as one item, the processing thread releases the slots
+def receive_batches(receiver):
+    showGameInfo = True
+    while True:
+        batch = receiver.receive(wait=True)
+        received = time.perf_counter()
+        if showGameInfo == True:
+            header = PacketHeader.from_buffer_copy(batch[0][1])
+            print(f"Game version: {header.m_game_major_version}.{header.m_game_minor_version} Packet format: {header.m_packet_format}")
+            showGameInfo = False
+        counters["received"] += len(batch)
+        for slot, datagram in batch:
+            packet_counts[datagram[PACKET_ID_OFFSET]] += 1
+            sequence.track(datagram)
+        try:
+            packets.put_nowait((received, batch))
+        except queue.Full:
+            counters["dropped"] += len(batch)
+            ring.release_all(batch)
+
 
 def start_driver(driver_name):
     listener = TelemetryListener(port=cfg["UDP_PORT"])
+    if cfg.get("UDP_RCVBUF"):
+        granted = set_receive_buffer(listener.socket, cfg["UDP_RCVBUF"])
+        if granted < cfg["UDP_RCVBUF"]:
+            print(f"Asked for a {cfg['UDP_RCVBUF']} byte receive buffer, got {granted}, raise net.core.rmem_max")
     print(f"Session for driver {driver_name} started ...")
     print(
         f"UDP Server listening to port {cfg['UDP_PORT']} on IP address: {socket.gethostbyname(socket.getfqdn())}"
     )
+    threading.Thread(target=process_packets, name="process_packets", args=(driver_name,), daemon=True).start()
+    if cfg.get("STATS_INTERVAL", 10):
+        threading.Thread(target=report_stats, name="report_stats", args=(cfg.get("STATS_INTERVAL", 10),), daemon=True).start()
+    if cfg.get("METRICS_PORT"):
+        serve_metrics(registry, cfg["METRICS_PORT"], cfg.get("METRICS_BIND", "127.0.0.1"))
+    if cfg.get("SELF_METRICS_INTERVAL"):
+        SelfMetrics(registry, metrics.ingest, cfg["SELF_METRICS_INTERVAL"], {"host": gethostname(), "driver": driver_name}).start()
+    if ring is not None:
+        receive_batches(BatchReceiver(listener.socket, ring, cfg["UDP_BATCH"]))
     showGameInfo = True
     # Receive Packages
     while True:
-        packet = listener.get()
+        datagram = listener.socket.recv(2048)
+        received = time.perf_counter()
+        counters["received"] += 1
+        packet_counts[datagram[PACKET_ID_OFFSET]] += 1
+        sequence.track(datagram)
         if showGameInfo== True:
-            print(f"Game version: {packet.m_header.m_game_major_version}.{packet.m_header.m_game_minor_version} Packet format: {packet.m_header.m_packet_format}") 
+            header = PacketHeader.from_buffer_copy(datagram)
+            print(f"Game version: {header.m_game_major_version}.{header.m_game_minor_version} Packet format: {header.m_packet_format}") 
             showGameInfo = False
-        packet_type = packet.m_header.m_packet_id  # get the packet type from the header
-        position = packet.m_header.m_player_car_index  # get the position of the driver
-        session_uid = packet.m_header.m_session_uid  # get the session uid  
-
-        # SESSION DATA
-        if packet_type == 1:
-            if position is not None:
-                metrics.set_dimensions(session_uid, driver_name, packet.m_track_id)
-            metrics.write_temperatures(packet.m_track_temperature, packet.m_air_temperature)
-
-        # LAP DATA
-        if packet_type == 2:
-            metrics.write_lap_data(packet.m_lap_data[position])
- 
-        # TELEMETRY DATA
-        if packet_type == 6:
-            metrics.write_telemetry_data(packet.m_car_telemetry_data[position])
-            
\ No newline at end of file
+        try:
+            packets.put_nowait((received, datagram))
+        except queue.Full:
+            counters["dropped"] += 1
@@ -0,0 +1,123 @@
+import struct
+import zlib
+from pyaccsharedmemory import accSharedMemory, read_physic_map, read_graphics_map, read_static_map  # type: ignore
+
+# First field of the physics and graphics pages, bumped by the sim on every update
+PACKET_ID = struct.Struct("=i")
+
+VECTOR = ("x", "y", "z")
+WHEELS = ("front_left", "front_right", "rear_left", "rear_right")
+DAMAGE = ("front", "rear", "left", "right", "center")
+CONTACT = tuple(f"{wheel}_{axis}" for wheel in WHEELS for axis in VECTOR)
+
+# The physics page (SPageFilePhysics) for a flatten.PageLayout, keys named as
+# pyaccsharedmemory's PhysicsMap; the fields ACC does not fill are skipped
+PHYSICS_FIELDS = (
+    ("packed_id", "i"),
+    ("gas", "f"),
+    ("brake", "f"),
+    ("fuel", "f"),
+    ("gear", "i"),
+    ("rpm", "i"),
+    ("steer_angle", "f"),
+    ("speed_kmh", "f"),
+    ("velocity", "f", VECTOR),
+    ("g_force", "f", VECTOR),
+    ("wheel_slip", "f", WHEELS),
+    (None, "f", 4),  # wheelLoad
+    ("wheel_pressure", "f", WHEELS),
+    ("wheel_angular_s", "f", WHEELS),
+    (None, "f", 8),  # tyreWear, tyreDirtyLevel
+    ("tyre_core_temp", "f", WHEELS),
+    (None, "f", 4),  # camberRAD
+    ("suspension_travel", "f", WHEELS),
+    (None, "i", 1),  # drs
+    ("tc", "f"),
+    ("heading", "f"),
+    ("pitch", "f"),
+    ("roll", "f"),
+    (None, "f", 1),  # cgHeight
+    ("car_damage", "f", DAMAGE),
+    (None, "i", 1),  # numberOfTyresOut
+    ("pit_limiter_on", "?"),
+    ("abs", "f"),
+    (None, "f", 2),  # kersCharge, kersInput
+    ("autoshifter_on", "?"),
+    (None, "f", 2),  # rideHeight
+    ("turbo_boost", "f"),
+    (None, "f", 2),  # ballast, airDensity
+    ("air_temp", "f"),
+    ("road_temp", "f"),
+    ("local_angular_vel", "f", VECTOR),
+    ("final_ff", "f"),
+    (None, "i", 9),  # performanceMeter, engineBrake, ers*, kersCurrentKJ, drsAvailable, drsEnabled
+    ("brake_temp", "f", WHEELS),
+    ("clutch", "f"),
+    (None, "f", 12),  # tyreTempI, tyreTempM, tyreTempO
+    ("is_ai_controlled", "?"),
+    ("tyre_contact_point", "f", CONTACT),
+    ("tyre_contact_normal", "f", CONTACT),
+    ("tyre_contact_heading", "f", CONTACT),
+    ("brake_bias", "f"),
+    ("local_velocity", "f", VECTOR),
+    (None, "i", 3),  # P2PActivation, P2PStatus, currentMaxRpm
+    (None, "f", 12),  # mz, fz, my
+    ("slip_ratio", "f", WHEELS),
+    ("slip_angle", "f", WHEELS),
+    (None, "i", 2),  # tcinAction, absinAction
+    ("suspension_damage", "f", WHEELS),
+    (None, "f", 4),  # tyreTemp
+    ("water_temp", "f"),
+    ("brake_pressure", "f", WHEELS),
+    ("front_brake_compound", "i"),
+    ("rear_brake_compound", "i"),
+    ("pad_life", "f", WHEELS),
+    ("disc_life", "f", WHEELS),
+    ("ignition_on", "?"),
+    ("starter_engine_on", "?"),
+    ("is_engine_running", "?"),
+    ("kerb_vibration", "f"),
+    ("slip_vibration", "f"),
+    ("g_vibration", "f"),
+    ("abs_vibration", "f"),
+)
+
+
+# Maps the ACC physics, graphics and static pages once for the life of the
+# listener, instead of opening a new accSharedMemory (three mmaps that were
+# never closed) on every poll. The packet counter is read in place from the
+# mapping and a page is only parsed when it moved. The static page has no
+# counter, it is parsed when the CRC of its bytes changed. A page with a
+# flatten.PageLayout in layouts is not parsed at all: its snapshot is
+# unpacked straight from the mapping.
+class SharedMemoryReader:
+    def __init__(self, memory=None, layouts=None):
+        self.memory = memory or accSharedMemory()
+        self.layouts = layouts or {}
+        self.pages = {
+            "physics": (self.memory.physicSM, read_physic_map, True),
+            "graphics": (self.memory.graphicSM, read_graphics_map, True),
+            "static": (self.memory.staticSM, read_static_map, False),
+        }
+        self.last = {}
+        self.unchanged = {page: 0 for page in self.pages}
+
+    def packet_id(self, page):
+        return PACKET_ID.unpack_from(self.pages[page][0], 0)[0]
+
+    # The parsed page (its Snapshot with a layout), or None when it has not
+    # changed since the last read
+    def read(self, page):
+        mapping, parse, counted = self.pages[page]
+        version = PACKET_ID.unpack_from(mapping, 0)[0] if counted else zlib.crc32(mapping)
+        if version == self.last.get(page):
+            self.unchanged[page] += 1
+            return None
+        self.last[page] = version
+        layout = self.layouts.get(page)
+        if layout is not None:
+            return layout.snapshot(mapping)
+        return parse(mapping)
+
+    def close(self):
+        self.memory.close()
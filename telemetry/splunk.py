@@ -2,10 +2,11 @@ import signalfx
 import logging
 import yaml
 import sys
-import json
-import requests
 import time
-import threading
+from telemetry.egress import HecSender, GaugeSender
+from telemetry.spool import Spool
+from telemetry.schema import MetricSchema, wheels
+from telemetry.emission import EmissionPolicy
 
 with open("config.yaml", "r") as ymlfile:
     cfg = yaml.safe_load(ymlfile)
@@ -17,9 +18,25 @@ sfx = signalfx.SignalFx(
 )
 
 ingest = sfx.ingest(cfg["SPLUNK_ACCESS_TOKEN"])
-
-url = cfg["SPLUNK_HEC_ENDPOINT"]
-headers = {"Authorization": "Splunk " + cfg["SPLUNK_HEC_TOKEN"]}
+o11y = GaugeSender(ingest, max_queue=cfg.get("SPLUNK_O11Y_QUEUE_SIZE", 10000), max_events=100, max_linger=0.1)
+
+# One long-lived sender batches every HEC event of this process, spooling
+# to disk while HEC is unreachable when a spool directory is configured
+hec_spool = None
+if cfg.get("SPLUNK_HEC_SPOOL_DIR"):
+    hec_spool = Spool(cfg["SPLUNK_HEC_SPOOL_DIR"], cfg.get("SPLUNK_HEC_SPOOL_MAX_MB", 256) * 1024 * 1024)
+
+hec = HecSender(
+    cfg["SPLUNK_HEC_ENDPOINT"],
+    cfg["SPLUNK_HEC_TOKEN"],
+    spool=hec_spool,
+    drain_rate=cfg.get("SPLUNK_HEC_SPOOL_DRAIN_RATE", 5),
+    max_queue=cfg.get("SPLUNK_HEC_QUEUE_SIZE", 10000),
+    max_events=cfg.get("SPLUNK_HEC_BATCH_SIZE", 500),
+    max_linger=cfg.get("SPLUNK_HEC_LINGER", 1.0),
+    max_bytes=cfg.get("SPLUNK_HEC_BATCH_BYTES", 0),
+    gzip_level=cfg.get("SPLUNK_HEC_GZIP_LEVEL", 0),
+)
 
 
 tracks = {
@@ -55,11 +72,42 @@ tracks = {
     29: "Jeddah",
 }
 
+telemetry_schema = MetricSchema(
+    "f1_2021.",
+    [
+        ("speed", "m_speed"),
+        ("engineRPM", "m_engine_rpm"),
+        ("gear", "m_gear"),
+        ("brake", "m_brake"),
+        *wheels("brakeTemp", "m_brakes_temperature"),
+        *wheels("tyresSurfaceTemp", "m_tyres_surface_temperature"),
+        *wheels("tyresInnerTemp", "m_tyres_inner_temperature"),
+    ],
+)
+
+# Per-metric emission policy for the high-rate car telemetry gauges
+emission = EmissionPolicy(cfg.get("EMISSION_POLICY"), cfg.get("EMISSION_DEFAULT", "all"))
+
+lap_data_schema = MetricSchema(
+    "f1_2021.",
+    [
+        ("currentLapNum", "m_current_lap_num"),
+        ("lastLapTime", "m_last_lap_time_in_ms"),
+        ("currentLapTime", "m_current_lap_time_in_ms"),
+    ],
+)
+
 dimensions = {}
 
 def set_dimensions(session_uid, driver_name, track_id):
-    dimensions["driver"] = driver_name
-    dimensions["track"] = tracks.get(track_id)
+    # Queued gauges keep referencing the dict they were built with, so swap in
+    # a new one rather than mutating it under the sender thread
+    global dimensions
+    dimensions = {"driver": driver_name, "track": tracks.get(track_id)}
+
+
+def stats():
+    return {"hec": hec.stats(), "o11y": o11y.stats()}
 
 
 def write_temperatures(track_temperature, air_temperature):
@@ -78,12 +126,11 @@ def write_temperatures(track_temperature, air_temperature):
             "value": air_temperature,
             "dimensions": dimensions,
         }]
-    
-    temps = threading.Thread(target=write_splunk_hec, name="splunk_temperature", args=(splunk_temperature_json,))
-    temps.start()
+
+    write_splunk_hec(splunk_temperature_json)
 
     if cfg["USE_SPLUNK_O11Y"] == True:
-        ingest.send(gauges=temperature_json)
+        o11y.send(temperature_json)
 
 
 def write_telemetry_data(car_telemetry_data):
@@ -92,100 +139,18 @@ def write_telemetry_data(car_telemetry_data):
     splunk_telemetry_json['metric_name:f1_2021.speed'] = car_telemetry_data.m_speed
     splunk_telemetry_json['metric_name:f1_2021.engineRPM'] = car_telemetry_data.m_engine_rpm
 
-
-    telemetry_json = [
-        {
-            "metric": "f1_2021.speed",
-            "value": car_telemetry_data.m_speed,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.engineRPM",
-            "value": car_telemetry_data.m_engine_rpm,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.gear",
-            "value": car_telemetry_data.m_gear,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.brake",
-            "value": car_telemetry_data.m_brake,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.brakeTempFL",
-            "value": car_telemetry_data.m_brakes_temperature[0],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.brakeTempFR",
-            "value": car_telemetry_data.m_brakes_temperature[1],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.brakeTempRL",
-            "value": car_telemetry_data.m_brakes_temperature[2],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.brakeTempRR",
-            "value": car_telemetry_data.m_brakes_temperature[3],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresSurfaceTempFL",
-            "value": car_telemetry_data.m_tyres_surface_temperature[0],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresSurfaceTempFR",
-            "value": car_telemetry_data.m_tyres_surface_temperature[1],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresSurfaceTempRL",
-            "value": car_telemetry_data.m_tyres_surface_temperature[2],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresSurfaceTempRR",
-            "value": car_telemetry_data.m_tyres_surface_temperature[3],
-            "dimensions": dimensions,
-        },        {
-            "metric": "f1_2021.tyresInnerTempFL",
-            "value": car_telemetry_data.m_tyres_inner_temperature[0],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresInnerTempFR",
-            "value": car_telemetry_data.m_tyres_inner_temperature[1],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresInnerTempRL",
-            "value": car_telemetry_data.m_tyres_inner_temperature[2],
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.tyresInnerTempRR",
-            "value": car_telemetry_data.m_tyres_inner_temperature[3],
-            "dimensions": dimensions,
-        },
-    ]
-
-    telemetry = threading.Thread(target=write_splunk_hec, name="splunk_telemetry", args=(splunk_telemetry_json,))
-    telemetry.start()
-
-    #for thread in threading.enumerate(): 
-    #    print(thread.name)
+    write_splunk_hec(splunk_telemetry_json)
 
     if cfg["USE_SPLUNK_O11Y"]== True:
-        ingest.send(gauges=telemetry_json)
+        metric_names = telemetry_schema.metrics
+        values = telemetry_schema.read(car_telemetry_data)
+        if emission:
+            metric_names, values = emission.filter_values("player", metric_names, values)
+        if values:
+            o11y.send_values(metric_names, values, dimensions)
 
         if car_telemetry_data.m_drs == 1:
-            ingest.send_event(
+            o11y.send_event(
                 event_type="m_drs_enabled",
                 category="USER_DEFINED",
                 dimensions=dimensions,
@@ -194,27 +159,12 @@ def write_telemetry_data(car_telemetry_data):
 
 def write_lap_data(m_lap_data):
     #logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-    lap_data_json = [
-        {
-            "metric": "f1_2021.currentLapNum",
-            "value": m_lap_data.m_current_lap_num,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.lastLapTime",
-            "value": m_lap_data.m_last_lap_time_in_ms,
-            "dimensions": dimensions,
-        },
-        {
-            "metric": "f1_2021.currentLapTime",
-            "value": m_lap_data.m_current_lap_time_in_ms,
-            "dimensions": dimensions,
-        },
-    ]
+    values = lap_data_schema.read(m_lap_data)
 
-    write_splunk_hec(lap_data_json)
+    if cfg["USE_SPUNK_HEC"] == True:
+        write_splunk_hec(lap_data_schema.gauges(values, dimensions))
     if cfg["USE_SPLUNK_O11Y"]== True:
-        ingest.send(gauges=lap_data_json)
+        o11y.send_values(lap_data_schema.metrics, values, dimensions)
 
 
 def write_splunk_hec(json_data):
@@ -226,5 +176,4 @@ def write_splunk_hec(json_data):
         event["host"] = "xbox"
         event["source"] = "metrics"
         event["fields"] = json_data
-        payload = json.dumps(event, separators=(',', ':'))
-        resp = requests.post(url, data=payload, headers=headers)
+        hec.send(event)
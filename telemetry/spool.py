@@ -0,0 +1,153 @@
+import os
+import struct
+import threading
+
+RECORD = struct.Struct("<I")
+SEGMENT_SUFFIX = ".seg"
+CURSOR = "cursor"
+
+
+# Disk-backed, append-only FIFO of undelivered payloads. Payloads are
+# appended length-prefixed to numbered segment files; once the spool grows
+# past max_bytes whole segments are evicted oldest first. The read position
+# of the oldest segment is kept in a cursor file so a restart resumes where
+# the drain stopped, a segment is deleted once it has been read completely.
+# Segment numbers only ever grow, also across restarts, so a cursor left
+# behind by a drained segment never matches a new one.
+class Spool:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, segment_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Segments stay well below the cap so eviction can keep the spool under it
+        self.segment_bytes = min(segment_bytes, max(max_bytes // 4, 1))
+        self.lock = threading.Lock()
+        self.counters = {"spooled": 0, "replayed": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name[: -len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self.sizes = {segment: os.path.getsize(self.path(segment)) for segment in self.segments}
+        self.writer = None
+        self.reader = None
+        cursor_segment, cursor_offset = self.load_cursor()
+        self.last_segment = max(self.segments + [cursor_segment or 0])
+        if cursor_segment in self.sizes:
+            self.read_segment, self.read_offset = cursor_segment, cursor_offset
+        else:
+            self.read_segment, self.read_offset = None, 0
+
+    def path(self, segment):
+        return os.path.join(self.directory, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR)) as cursor:
+                segment, offset = (int(value) for value in cursor.read().split())
+        except (OSError, ValueError):
+            return None, 0
+        return segment, offset
+
+    def save_cursor(self):
+        path = os.path.join(self.directory, CURSOR)
+        with open(path + ".tmp", "w") as cursor:
+            cursor.write(f"{self.read_segment} {self.read_offset}")
+        os.replace(path + ".tmp", path)
+
+    def append(self, payload):
+        with self.lock:
+            if self.writer is None or self.sizes[self.segments[-1]] >= self.segment_bytes:
+                self.roll()
+            self.writer.write(RECORD.pack(len(payload)) + payload)
+            self.writer.flush()
+            self.sizes[self.segments[-1]] += RECORD.size + len(payload)
+            self.counters["spooled"] += 1
+            self.evict()
+
+    # Start a new segment for writing
+    def roll(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.last_segment += 1
+        segment = self.last_segment
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.writer = open(self.path(segment), "ab")
+
+    # Drop the oldest segments, never the one being written, until under the cap
+    def evict(self):
+        while sum(self.sizes.values()) > self.max_bytes and len(self.segments) > 1:
+            segment = self.segments.pop(0)
+            if self.reader is not None and self.read_segment == segment:
+                self.reader.close()
+                self.reader = None
+            offset = self.read_offset if self.read_segment == segment else 0
+            self.counters["evicted"] += count_records(self.path(segment), offset)
+            os.remove(self.path(segment))
+            del self.sizes[segment]
+            if self.read_segment == segment:
+                self.read_segment, self.read_offset = None, 0
+
+    # The oldest payload, or None when the spool is drained. It stays in the
+    # spool until ack() so a failed delivery is retried.
+    def peek(self):
+        with self.lock:
+            while self.segments:
+                segment = self.segments[0]
+                if self.read_segment != segment:
+                    self.read_segment, self.read_offset = segment, 0
+                if self.reader is None or self.reader.name != self.path(segment):
+                    if self.reader is not None:
+                        self.reader.close()
+                    self.reader = open(self.path(segment), "rb")
+                self.reader.seek(self.read_offset)
+                header = self.reader.read(RECORD.size)
+                if len(header) == RECORD.size:
+                    (length,) = RECORD.unpack(header)
+                    payload = self.reader.read(length)
+                    if len(payload) == length:
+                        return payload
+                if segment == self.segments[-1]:
+                    if self.read_offset < self.sizes[segment]:
+                        return None
+                    # Drained completely, the next append starts a new segment
+                    if self.writer is not None:
+                        self.writer.close()
+                        self.writer = None
+                # Fully read, or cut short by a crash: move on to the next segment
+                self.reader.close()
+                self.reader = None
+                os.remove(self.path(segment))
+                self.segments.pop(0)
+                del self.sizes[segment]
+            return None
+
+    # The payload returned by peek() was delivered
+    def ack(self, payload):
+        with self.lock:
+            self.read_offset += RECORD.size + len(payload)
+            self.counters["replayed"] += 1
+            self.save_cursor()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["spool_bytes"] = sum(self.sizes.values()) - (self.read_offset if self.read_segment in self.sizes else 0)
+        return stats
+
+    def close(self):
+        with self.lock:
+            for file in (self.writer, self.reader):
+                if file is not None:
+                    file.close()
+            self.writer = self.reader = None
+
+
+def count_records(path, offset=0):
+    records = 0
+    with open(path, "rb") as segment:
+        segment.seek(offset)
+        while True:
+            header = segment.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return records
+            segment.seek(RECORD.unpack(header)[0], os.SEEK_CUR)
+            records += 1